@@ -0,0 +1,129 @@
+"""
+Async Throughput Benchmark
+
+Sends the same reads to the sync server and to the async server of
+service.asgi with many connections open at once, and prints the
+requests per second and the latencies of both.
+
+Start both servers on the same database first, for example:
+  gunicorn --workers=1 --bind=:8080 "service:create_app()"
+  gunicorn --workers=1 -k uvicorn.workers.UvicornWorker --bind=:8081 service.asgi:application
+
+Usage:
+  python -m benchmarks.async_throughput --sync http://localhost:8080 \\
+      --async http://localhost:8081 --connections 50 --requests 2000
+
+The Orders created by the benchmark are deleted when done.
+"""
+import json
+import time
+import random
+import argparse
+import statistics
+from http.client import HTTPConnection
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+
+
+def request(base_url: str, method: str, path: str, body=None):
+    """Sends one request on a new connection and returns its status and body"""
+    connection = HTTPConnection(urlsplit(base_url).netloc)
+    try:
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        connection.request(method, path, json.dumps(body) if body is not None else None, headers)
+        response = connection.getresponse()
+        return response.status, response.read()
+    finally:
+        connection.close()
+
+
+def seed(base_url: str, order_count: int, items_per_order: int) -> list:
+    """Creates the Orders to read and returns their ids"""
+    orders = [
+        {
+            "customer_id": random.randint(1, 100),
+            "tracking_id": number,
+            "status": "PLACED",
+            "order_items": [
+                {"product_id": random.randint(1, 1000), "quantity": 1, "price": 9.99}
+                for _ in range(items_per_order)
+            ],
+        }
+        for number in range(order_count)
+    ]
+    code, body = request(base_url, "POST", "/api/orders:batch", orders)
+    if code != 201:
+        raise RuntimeError(f"Could not create the Orders: {code} {body!r}")
+    return json.loads(body)["ids"]
+
+
+def run(base_url: str, paths: list, connections: int, requests: int) -> dict:
+    """Reads the paths with as many connections at once and measures every request"""
+    netloc = urlsplit(base_url).netloc
+    per_connection = requests // connections
+
+    def client(number: int) -> tuple:
+        # one keep-alive connection per client, like a browser or a proxy
+        connection = HTTPConnection(netloc)
+        latencies = []
+        errors = 0
+        try:
+            for count in range(per_connection):
+                start = time.perf_counter()
+                connection.request("GET", paths[(number + count) % len(paths)])
+                response = connection.getresponse()
+                response.read()
+                latencies.append(time.perf_counter() - start)
+                if response.status != 200:
+                    errors += 1
+        finally:
+            connection.close()
+        return latencies, errors
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=connections) as executor:
+        results = list(executor.map(client, range(connections)))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency for result in results for latency in result[0])
+    return {
+        "requests": len(latencies),
+        "errors": sum(result[1] for result in results),
+        "per_second": len(latencies) / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+    }
+
+
+def main():
+    """Runs the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sync", default="http://localhost:8080", help="URL of the sync server")
+    parser.add_argument("--async", dest="async_", default="http://localhost:8081",
+                        help="URL of the async server")
+    parser.add_argument("--connections", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--orders", type=int, default=100)
+    parser.add_argument("--items-per-order", type=int, default=3)
+    args = parser.parse_args()
+
+    ids = seed(args.sync, args.orders, args.items_per_order)
+    # a mix of the reads that the async server answers with coroutines
+    paths = ["/api/orders?limit=20", "/api/orders?embed=items&limit=20"]
+    paths += [f"/api/orders/{order_id}/items" for order_id in ids[:20]]
+    try:
+        print(f"{args.requests} reads of {len(paths)} urls on {args.connections} connections")
+        for name, base_url in (("sync", args.sync), ("async", args.async_)):
+            result = run(base_url, paths, args.connections, args.requests)
+            print(
+                f"{name:>6}: {result['per_second']:8.1f} requests/s  "
+                f"p50 {result['p50_ms']:7.1f} ms  p99 {result['p99_ms']:7.1f} ms  "
+                f"{result['errors']} errors"
+            )
+    finally:
+        for order_id in ids:
+            request(args.sync, "DELETE", f"/api/orders/{order_id}")
+
+
+if __name__ == "__main__":
+    main()
@@ -34,11 +34,16 @@ def step_impl(context):
     # List all of the pets and delete them one by one
     context.order_ids = list()
     rest_endpoint = f"{context.BASE_URL}/api/orders"
-    context.resp = requests.get(rest_endpoint)
-    expect(context.resp.status_code).to_equal(200)
-    for order in context.resp.json():
-        context.resp = requests.delete(f"{rest_endpoint}/{order['id']}")
-        expect(context.resp.status_code).to_equal(204)
+    # the list is paged, so keep deleting the first page until none are left
+    while True:
+        context.resp = requests.get(rest_endpoint)
+        expect(context.resp.status_code).to_equal(200)
+        orders = context.resp.json()
+        if not orders:
+            break
+        for order in orders:
+            context.resp = requests.delete(f"{rest_endpoint}/{order['id']}")
+            expect(context.resp.status_code).to_equal(204)
 
     # load the database with new orders
     for row in context.table:
@@ -0,0 +1,175 @@
+"""
+Gunicorn configuration
+
+Gunicorn loads this file from the working directory. It sizes the workers
+and threads from the CPU quota and memory limit of the container, and
+exports them as WEB_CONCURRENCY and GUNICORN_THREADS so service.config
+sizes the connection pool of every worker to match: each thread holds at
+most one connection and all of them fit in DB_MAX_CONNECTIONS.
+
+Any of the settings can be overridden with environment variables:
+
+  GUNICORN_WORKER_CLASS      gthread (default), gevent or uvicorn.workers.UvicornWorker
+  WEB_CONCURRENCY            workers, 2 per CPU + 1 as memory allows by default
+  GUNICORN_THREADS           threads of each worker, 4 by default
+  GUNICORN_WORKER_MEMORY_MB  memory kept for each worker, 100 by default
+  GUNICORN_PRELOAD           load the app once before forking, true by default
+  GUNICORN_MAX_REQUESTS      requests before a worker is replaced, 1000 by default
+  GUNICORN_KEEPALIVE         seconds to keep idle connections open, 5 by default
+
+The gthread and gevent workers serve the Flask app:
+
+  gunicorn "service:create_app()"
+
+while uvicorn.workers.UvicornWorker needs the ASGI application instead:
+
+  GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker gunicorn service.asgi:application
+
+With GUNICORN_PRELOAD the master runs service.create_app() once and the
+workers share its memory. The hooks below dispose of the connection pool
+around every fork so each worker opens connections of its own, and keep
+the Prometheus samples of the workers in PROMETHEUS_MULTIPROC_DIR in
+step with the workers that are alive.
+"""
+import os
+import sys
+import glob
+import math
+
+CGROUP = "/sys/fs/cgroup"
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+if PROMETHEUS_MULTIPROC_DIR:
+    # a preloaded app writes its samples there before any of the hooks run
+    os.makedirs(PROMETHEUS_MULTIPROC_DIR, exist_ok=True)
+# the same default as service.config
+DB_MAX_CONNECTIONS = int(os.getenv("DB_MAX_CONNECTIONS", "100"))
+
+
+def read_value(*paths):
+    """Returns the first line of the first of the files that exists, or None"""
+    for path in paths:
+        try:
+            with open(path, encoding="utf-8") as file:
+                return file.readline().strip()
+        except OSError:
+            continue
+    return None
+
+
+def cpu_limit(cgroup: str = CGROUP) -> int:
+    """Returns the number of CPUs the container may use, rounded up"""
+    if hasattr(os, "sched_getaffinity"):
+        cpus = len(os.sched_getaffinity(0))
+    else:  # pragma: no cover
+        cpus = os.cpu_count() or 1
+    # cgroup v2 writes "quota period", v1 has a file for each, a quota of max or -1 means none
+    quota = read_value(f"{cgroup}/cpu.max")
+    if quota is not None:
+        quota, _, period = quota.partition(" ")
+    else:
+        folders = (f"{cgroup}/cpu", f"{cgroup}/cpu,cpuacct")
+        quota = read_value(*(f"{folder}/cpu.cfs_quota_us" for folder in folders))
+        period = read_value(*(f"{folder}/cpu.cfs_period_us" for folder in folders))
+    if quota and period and quota not in ("max", "-1"):
+        cpus = min(cpus, math.ceil(int(quota) / int(period)))
+    return max(cpus, 1)
+
+
+def memory_limit(cgroup: str = CGROUP) -> int:
+    """Returns the bytes of memory the container may use"""
+    memory = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    # v1 reports no limit as a huge number rather than max
+    limit = read_value(f"{cgroup}/memory.max", f"{cgroup}/memory/memory.limit_in_bytes")
+    if limit and limit != "max":
+        memory = min(memory, int(limit))
+    return memory
+
+
+def tune(cpus: int, memory: int, kind: str, env=os.environ) -> tuple:
+    """Returns the number of workers and the threads of each worker to run
+
+    :param cpus: the CPUs the container may use
+    :param memory: the bytes of memory the container may use
+    :param kind: the worker class
+    :param env: the environment, whose WEB_CONCURRENCY and GUNICORN_THREADS win
+
+    """
+    worker_memory = int(env.get("GUNICORN_WORKER_MEMORY_MB", "100")) * 1024 * 1024
+    count = int(env.get("WEB_CONCURRENCY") or max(min(2 * cpus + 1, memory // worker_memory), 1))
+    count = min(count, DB_MAX_CONNECTIONS)
+    if kind == "gevent":
+        # a greenlet per client, the pool bounds how many of them query at once
+        per_worker = int(env.get("GUNICORN_THREADS") or DB_MAX_CONNECTIONS // count)
+    else:
+        per_worker = int(env.get("GUNICORN_THREADS") or 4)
+    # one connection per thread, and every thread of every worker gets one
+    return count, max(min(per_worker, DB_MAX_CONNECTIONS // count), 1)
+
+
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+CPUS, MEMORY = cpu_limit(), memory_limit()
+workers, threads = tune(CPUS, MEMORY, worker_class)
+# read by service.config to size the connection pool of each worker
+os.environ["WEB_CONCURRENCY"] = str(workers)
+os.environ["GUNICORN_THREADS"] = str(threads)
+
+bind = os.getenv("GUNICORN_BIND", f"0.0.0.0:{os.getenv('PORT', '8080')}")
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() == "true"
+# replace workers now and then so a leak cannot grow forever, not all at once
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "1000"))
+max_requests_jitter = max_requests // 10
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+
+
+def on_starting(server):
+    """Logs the tuning and removes the samples left behind by the last run"""
+    server.log.info(
+        "Starting %s %s workers with %s threads each, for %s CPUs and %s MB",
+        workers, worker_class, threads, CPUS, MEMORY // (1024 * 1024),
+    )
+    if PROMETHEUS_MULTIPROC_DIR:
+        remove_stale_samples(PROMETHEUS_MULTIPROC_DIR, os.getpid())
+
+
+def remove_stale_samples(folder: str, pid: int):
+    """Removes the sample files of the last run, but not those of the preloaded master"""
+    for name in glob.glob(os.path.join(folder, "*.db")):
+        if not name.endswith(f"_{pid}.db"):
+            os.remove(name)
+
+
+def preloaded_engine(server):
+    """Returns the database engine of the app the master loaded, None if it loaded none"""
+    app = server.app.callable
+    if app is None:
+        return None
+    asgi = sys.modules.get("service.asgi")
+    if asgi is not None and app is asgi.application:
+        # the ASGI application serves the Flask app of its module
+        app = asgi.app
+    return sys.modules["service.models"].db.get_engine(app)
+
+
+def pre_fork(server, worker):  # pylint: disable=unused-argument
+    """Closes the connections the preloaded app opened, so no worker shares them"""
+    engine = preloaded_engine(server)
+    if engine is not None:
+        engine.dispose()
+
+
+def post_fork(server, worker):  # pylint: disable=unused-argument
+    """Gives the worker a pool of its own and makes psycopg2 yield to the other greenlets"""
+    engine = preloaded_engine(server)
+    if engine is not None:
+        # leaves the connections of the master open, they are not the worker's to close
+        engine.dispose(close=False)
+    if worker_class == "gevent":
+        from psycogreen.gevent import patch_psycopg  # pylint: disable=import-outside-toplevel
+        patch_psycopg()
+
+
+def child_exit(server, worker):  # pylint: disable=unused-argument
+    """Drops the live gauges of a worker that exited"""
+    if PROMETHEUS_MULTIPROC_DIR:
+        from prometheus_client import multiprocess  # pylint: disable=import-outside-toplevel
+        multiprocess.mark_process_dead(worker.pid)
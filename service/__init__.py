@@ -3,28 +3,23 @@ Package: service
 Package for the application models and service routes
 This module creates and configures the Flask app and sets up the logging
 and SQL database
+
+The app is built by create_app(), so importing the package has no side
+effects and gunicorn can preload it once and fork the workers from it:
+  gunicorn "service:create_app()"
 """
-import os
 import sys
 import logging
 from flask import Flask
 from flask_restx import Api
 from service import config
-from .utils import log_handlers
-
-# Create Flask application
-app = Flask(__name__)
-
-app.url_map.strict_slashes = False
-
-app.config['LOGGING_LEVEL'] = logging.INFO
+from .utils import log_handlers, metrics, profiling, compression, migrations
 
 
 ######################################################################
 # Configure Swagger before initializing it
 ######################################################################
-api = Api(app,
-          version='1.0.0',
+api = Api(version='1.0.0',
           title='Order REST API Service',
           description='This is a sample order server @ NYU-DevOps 2022 Summer Orders Team.',
           default='orders',
@@ -32,23 +27,45 @@ api = Api(app,
           doc='/apidocs',  # default also could use doc='/apidocs/'
           prefix='/api')
 
-# Dependencies require we import the routes AFTER the Flask app is created
+# Dependencies require we import the routes AFTER the Api is created
 # pylint: disable=wrong-import-position, wrong-import-order
 from service import routes, models        # noqa: F401, E402
 from service.utils import error_handlers, cli_commands  # noqa: F401, E402
 
-# Set up logging for production
-log_handlers.init_logging(app, "gunicorn.error")
 
-app.logger.info(70 * "*")
-app.logger.info(" O R D E R   S E R V I C E   R U N N I N G  ".center(70, "*"))
-app.logger.info(70 * "*")
+def create_app() -> Flask:
+    """Creates the Flask app, its routes and its tables"""
+    app = Flask(__name__)
+    app.config.from_object(config)
+    app.url_map.strict_slashes = False
+    app.config['LOGGING_LEVEL'] = logging.INFO
+
+    api.init_app(app)
+    app.register_blueprint(routes.blueprint)
+    app.cli.add_command(cli_commands.create_db)
+    app.cli.add_command(cli_commands.db_upgrade)
+
+    # Set up logging for production
+    log_handlers.init_logging(app, "gunicorn.error")
+    models.init_db(app)
+    profiling.init_profiling(app, models.db)
+    metrics.init_metrics(app)
+    # registered last so it runs first and the metrics include the time compressing
+    compression.init_compression(app)
+
+    app.logger.info(70 * "*")
+    app.logger.info(" O R D E R   S E R V I C E   R U N N I N G  ".center(70, "*"))
+    app.logger.info(70 * "*")
 
-try:
-    models.init_db(app)  # make our SQLAlchemy tables
-except Exception as error:  # pylint: disable=broad-except
-    app.logger.critical("%s: Cannot continue", error)
-    # gunicorn requires exit code 4 to stop spawning workers when they die
-    sys.exit(4)
+    try:
+        # the tables are made by flask db-upgrade, which has to load the app before they are
+        if not cli_commands.in_flask_command():
+            with app.app_context():
+                migrations.check(models.db.engine)
+    except Exception as error:  # pylint: disable=broad-except
+        app.logger.critical("%s: Cannot continue", error)
+        # gunicorn requires exit code 4 to stop spawning workers when they die
+        sys.exit(4)
 
-app.logger.info("Service initialized!")
+    app.logger.info("Service initialized!")
+    return app
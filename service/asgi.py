@@ -0,0 +1,190 @@
+"""
+ASGI Application
+
+This module serves the app on an ASGI server, with the reads of Orders
+and Items of service.routes run by coroutines that query the database
+through an async engine on asyncpg. A slow query then holds only its
+own request instead of one of the few threads of a worker.
+
+Usage:
+  gunicorn -k uvicorn.workers.UvicornWorker service.asgi:application
+
+The coroutines answer GET on these paths with the same reads as the
+resources of service.routes, except for the Order cache, and they run
+the same before and after request hooks:
+
+  /api/orders
+  /api/orders/<order_id>
+  /api/orders/<order_id>/items
+  /api/orders/<order_id>/items/<item_id>
+  /api/items
+
+Every other request, like the writes, the exports and the Swagger docs,
+is passed to the Flask app by a2wsgi, on one of the GUNICORN_THREADS
+threads of the worker.
+"""
+from io import BytesIO
+from a2wsgi import WSGIMiddleware
+from a2wsgi.wsgi import build_environ
+from flask import Response
+from flask_restx.utils import unpack
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from werkzeug.exceptions import HTTPException
+from werkzeug.routing import Map, Rule
+from service import api, config, create_app
+from service.routes import read_all_items, read_item, read_items, read_order, read_orders
+from service.utils import profiling
+
+
+class AsyncDatabase:
+    """
+    The async engine of a worker
+
+    The engine is only created when it is first used, so every worker
+    opens its own connections after gunicorn forked it
+    """
+
+    def __init__(self, url: str, options: dict):
+        self.url = url
+        self.options = options
+        self._engine = None
+
+    @property
+    def engine(self):
+        """Returns the engine, creating it on first use"""
+        if self._engine is None:
+            self._engine = create_async_engine(self.url, **self.options)
+            if profiling.is_enabled(app.config):
+                profiling.profile_engine(self._engine.sync_engine)
+        return self._engine
+
+    def session(self) -> AsyncSession:
+        """Returns a new session of the engine"""
+        return AsyncSession(self.engine)
+
+    async def dispose(self):
+        """Closes the connections of the engine"""
+        if self._engine is not None:
+            await self._engine.dispose()
+            self._engine = None
+
+
+app = create_app()
+database = AsyncDatabase(config.ASYNC_DATABASE_URI, config.ASYNC_ENGINE_OPTIONS)
+
+
+def wsgi_app(environ, start_response):
+    """Answers a request with the Flask app, which reads a chunked body to the end of it"""
+    environ["wsgi.input_terminated"] = True
+    return app(environ, start_response)
+
+
+# answers the requests of the Flask app on the threads of the worker
+wsgi = WSGIMiddleware(wsgi_app, workers=config.THREADS)
+
+# the reads of service.routes that are run on the async engine
+routes = Map([
+    Rule(f"{api.prefix}/orders", endpoint=read_orders),
+    Rule(f"{api.prefix}/orders/<int:order_id>", endpoint=read_order),
+    Rule(f"{api.prefix}/orders/<int:order_id>/items", endpoint=read_items),
+    Rule(f"{api.prefix}/orders/<int:order_id>/items/<int:item_id>", endpoint=read_item),
+    Rule(f"{api.prefix}/items", endpoint=read_all_items),
+])
+
+
+######################################################################
+#  A S G I   A P P L I C A T I O N
+######################################################################
+async def application(scope, receive, send):
+    """Answers the requests of an ASGI server"""
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        raise ValueError(f"Unsupported ASGI scope type {scope['type']}")
+
+    read, view_args = match(scope)
+    if read is None:
+        await wsgi(scope, receive, send)
+        return
+    # the read runs on the event loop, where the body cannot be read as it is needed
+    environ = build_environ(scope, BytesIO(await read_body(receive)))
+    environ["wsgi.input_terminated"] = True
+    response = await dispatch(read, environ, view_args)
+    await send({
+        "type": "http.response.start",
+        "status": response.status_code,
+        "headers": [
+            (name.lower().encode("latin-1"), value.encode("latin-1"))
+            for name, value in response.headers.items()
+        ],
+    })
+    await send({"type": "http.response.body", "body": response.get_data()})
+
+
+async def lifespan(receive, send):
+    """Creates the engine when the worker starts and closes its connections when it stops"""
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            try:
+                database.engine  # pylint: disable=pointless-statement
+            except Exception as error:  # pylint: disable=broad-except
+                await send({"type": "lifespan.startup.failed", "message": str(error)})
+                return
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await database.dispose()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def read_body(receive) -> bytes:
+    """Returns the whole body of a request"""
+    chunks = []
+    more_body = True
+    while more_body:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        more_body = message.get("more_body", False)
+    return b"".join(chunks)
+
+
+def match(scope) -> tuple:
+    """Returns the read that answers a request and its arguments, or None for the Flask app"""
+    if scope["method"] != "GET":
+        return None, None
+    try:
+        # the path of the scope does not include its root_path
+        return routes.bind("localhost").match(scope["path"])
+    except HTTPException:
+        return None, None
+
+
+async def run_read(session, read):
+    """Runs a read of service.routes on an AsyncSession and returns its response"""
+    try:
+        method, query = next(read)
+        while True:
+            result = await session.execute(query.statement)
+            method, query = read.send(getattr(result, method)())
+    except StopIteration as done:
+        return done.value
+
+
+async def dispatch(read, environ, view_args) -> Response:
+    """Answers a request with a read, running the hooks and error handlers of the Flask app"""
+    with app.request_context(environ):
+        try:
+            try:
+                result = app.preprocess_request()
+                if result is None:
+                    async with database.session() as session:
+                        result = await run_read(session, read(**view_args))
+                if not isinstance(result, Response):
+                    result = api.make_response(*unpack(result))
+            except Exception as error:  # pylint: disable=broad-except
+                result = app.handle_user_exception(error)
+            return app.finalize_request(result)
+        except Exception as error:  # pylint: disable=broad-except
+            return app.handle_exception(error)
@@ -2,6 +2,7 @@
 Global Configuration for Application
 """
 import os
+import re
 import json
 import logging
 
@@ -19,7 +20,78 @@ if 'VCAP_SERVICES' in os.environ:
 # Configure SQLAlchemy
 SQLALCHEMY_DATABASE_URI = DATABASE_URI
 SQLALCHEMY_TRACK_MODIFICATIONS = False
-SQLALCHEMY_POOL_SIZE = 2
+
+# Gunicorn workers and the threads of each worker. Every worker has its
+# own connection pool with one connection for each of its threads, and
+# overflow for bursts as long as all of the pools fit in DB_MAX_CONNECTIONS
+WORKERS = int(os.getenv("WEB_CONCURRENCY", "1"))
+THREADS = int(os.getenv("GUNICORN_THREADS", "1"))
+DB_MAX_CONNECTIONS = int(os.getenv("DB_MAX_CONNECTIONS", "100"))
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", str(THREADS)))
+DB_MAX_OVERFLOW = int(os.getenv(
+    "DB_MAX_OVERFLOW",
+    str(max(min(THREADS, DB_MAX_CONNECTIONS // WORKERS - DB_POOL_SIZE), 0))
+))
+# seconds to wait for a connection before failing the request
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "10"))
+# seconds after which a connection is replaced
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# test connections on checkout so a database failover drops stale ones
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+SQLALCHEMY_ENGINE_OPTIONS = {
+    "pool_size": DB_POOL_SIZE,
+    "max_overflow": DB_MAX_OVERFLOW,
+    "pool_timeout": DB_POOL_TIMEOUT,
+    "pool_recycle": DB_POOL_RECYCLE,
+    "pool_pre_ping": DB_POOL_PRE_PING,
+}
+
+# The async server of service.asgi reads through asyncpg. The requests of a
+# worker share the connections of its async pool instead of holding one each
+ASYNC_DATABASE_URI = os.getenv(
+    "ASYNC_DATABASE_URI",
+    re.sub(r"^postgresql(\+\w+)?://", "postgresql+asyncpg://", DATABASE_URI)
+)
+ASYNC_DB_POOL_SIZE = int(os.getenv("ASYNC_DB_POOL_SIZE", "10"))
+ASYNC_ENGINE_OPTIONS = {
+    "pool_size": ASYNC_DB_POOL_SIZE,
+    "max_overflow": 0,
+    "pool_timeout": DB_POOL_TIMEOUT,
+    "pool_recycle": DB_POOL_RECYCLE,
+    "pool_pre_ping": DB_POOL_PRE_PING,
+}
+
+# Pagination for list endpoints
+PAGE_SIZE = int(os.getenv("PAGE_SIZE", "100"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "1000"))
+
+# Number of rows fetched at a time from the server side cursor of an export
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+# Largest number of Orders accepted by one batch create
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "1000"))
+
+# Cache of single Orders: none://, local:// or redis://host:port/db
+# A local cache is only invalidated by the worker that made the change,
+# so it is only the default for one worker, use a redis cache for more
+CACHE_URL = os.getenv("CACHE_URL", "local://" if WORKERS == 1 else "none://")
+CACHE_TTL = int(os.getenv("CACHE_TTL", "30"))
+CACHE_MAX_SIZE = int(os.getenv("CACHE_MAX_SIZE", "10000"))
+
+# Compression of responses negotiated with Accept-Encoding, br needs brotli installed
+COMPRESS_ENABLED = os.getenv("COMPRESS_ENABLED", "true").lower() == "true"
+# bodies smaller than this many bytes are not worth compressing
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "500"))
+COMPRESS_LEVEL = int(os.getenv("COMPRESS_LEVEL", "6"))
+COMPRESS_BROTLI_LEVEL = int(os.getenv("COMPRESS_BROTLI_LEVEL", "4"))
+
+# Encoder of the list endpoints: json, or orjson for compact JSON when it is installed
+JSON_ENCODER = os.getenv("JSON_ENCODER", "json")
+
+# Log every SQL statement slower than this many milliseconds, 0 to turn it off
+SLOW_QUERY_MS = int(os.getenv("SLOW_QUERY_MS", "500"))
+# Report the SQL statements of every request in a Server-Timing header and a log line
+SQL_PROFILING = os.getenv("SQL_PROFILING", "false").lower() == "true"
 
 # Secret for session management
 SECRET_KEY = os.getenv("SECRET_KEY", "sup3r-s3cr3t")
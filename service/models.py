@@ -9,11 +9,13 @@ import logging
 from enum import Enum
 from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from service.utils.pool import MeteredQueuePool
 
 logger = logging.getLogger("flask.app")
 
 # Create the SQLAlchemy object to be initialized later in init_db()
-db = SQLAlchemy()
+db = SQLAlchemy(engine_options={"poolclass": MeteredQueuePool})
 
 
 class DataValidationError(Exception):
@@ -38,6 +40,25 @@ class OrderStatus(Enum):
     DELIVERED = 3
     CANCELLED = 4
 
+    @classmethod
+    def parse(cls, value: str) -> tuple:
+        """Parses comma separated status names, in any case, into a tuple of statuses
+
+        Blank names are skipped so an empty value matches every status.
+
+        :raises ValueError: when one of the names is not a status
+        """
+        statuses = []
+        for name in filter(None, (name.strip() for name in value.split(","))):
+            try:
+                status = cls[name.upper()]
+            except KeyError as error:
+                names = ", ".join(cls._member_names_)
+                raise ValueError(f"'{name}' is not one of {names}") from error
+            if status not in statuses:
+                statuses.append(status)
+        return tuple(statuses)
+
 ######################################################################
 #  P E R S I S T E N T   B A S E   M O D E L
 ######################################################################
@@ -58,6 +79,20 @@ class PersistentBase:
         db.session.add(self)
         db.session.commit()
 
+    @classmethod
+    def create_many(cls, records: list):
+        """
+        Creates many Orders/Items to the database in one transaction
+
+        The ORM sends the new rows of each table as one batched
+        INSERT ... RETURNING, so the ids are set in the given order
+        """
+        logger.info("Creating %d records", len(records))
+        for record in records:
+            record.id = None  # id must be none to generate next primary key
+        db.session.add_all(records)
+        db.session.commit()
+
     def update(self):
         """
         Updates an Order/Item to the database
@@ -73,13 +108,15 @@ class PersistentBase:
 
     @classmethod
     def init_db(cls, app):
-        """Initializes the database session"""
+        """Initializes the database session
+
+        The records are used in a context of the app, which every request
+        has and anything else has to push with app.app_context()
+        """
         logger.info("Initializing database")
-        cls.app = app
-        # This is where we initialize SQLAlchemy from the Flask app
-        db.init_app(app)
-        app.app_context().push()
-        db.create_all()  # make our sqlalchemy tables
+        # This is where we initialize SQLAlchemy from the Flask app, once so its engine is kept
+        if "sqlalchemy" not in app.extensions:
+            db.init_app(app)
 
     @classmethod
     def all(cls):
@@ -87,6 +124,74 @@ class PersistentBase:
         logger.info("Processing all records")
         return cls.query.all()
 
+    @classmethod
+    def find_version(cls, by_id):
+        """Returns the version of a record by it's ID without loading it"""
+        logger.info("Processing version lookup for id %s ...", by_id)
+        return cls.version_query(by_id).scalar()
+
+    @classmethod
+    def version_query(cls, by_id):
+        """Returns a query of the version of a record by it's ID, for find_version()"""
+        return db.session.query(cls.version).filter(cls.id == by_id)
+
+    @classmethod
+    def rows(cls, columns=None):
+        """Returns a query of the table rows of the records, without building any objects
+
+        :param columns: the names of the columns or column properties to read,
+            all of the table columns by default
+
+        """
+        if columns is None:
+            return db.session.query(cls.__table__)
+        return db.session.query(*[getattr(cls, name) for name in columns])
+
+    @classmethod
+    def paginate(cls, query=None, after_id: int = None, limit: int = 100):
+        """Returns one page of records using keyset pagination on the id
+
+        :param query: the query to page through, defaults to all records
+        :param after_id: only records with an id greater than this are returned
+        :param limit: the maximum number of records to return
+
+        :return: the records of the page and whether there are more after it
+        :rtype: tuple
+
+        """
+        logger.info("Processing page after id %s with limit %d ...", after_id, limit)
+        if query is None:
+            query = cls.query
+        records = cls.page_query(query, after_id, limit).all()
+        return records[:limit], len(records) > limit
+
+    @classmethod
+    def page_query(cls, query, after_id: int = None, limit: int = 100):
+        """Returns the query of one page of paginate(), with one extra record
+
+        The extra record is only there to learn if there is a next page
+
+        """
+        if after_id is not None:
+            query = query.filter(cls.id > after_id)
+        return query.order_by(cls.id).limit(limit + 1)
+
+    @classmethod
+    def stream(cls, query=None, batch_size: int = 1000):
+        """Returns an iterator over the records read from a server side cursor
+
+        :param query: the query to read, defaults to all records
+        :param batch_size: the number of rows fetched from the cursor at a time
+
+        :return: the records in the order of their id
+        :rtype: iterator
+
+        """
+        logger.info("Processing stream of records in batches of %d ...", batch_size)
+        if query is None:
+            query = cls.query
+        return query.order_by(cls.id).yield_per(batch_size)
+
     @classmethod
     def find(cls, by_id):
         """Finds a record by it's ID"""
@@ -105,11 +210,20 @@ class Item(db.Model, PersistentBase):
     """
 
     # Table Schema
+    # order_id leads the composite index so it also serves the items of one order, by id
+    __table_args__ = (
+        db.Index("ix_item_order_id_id", "order_id", "id"),
+    )
     id = db.Column(db.Integer, primary_key=True)
-    order_id = db.Column(db.Integer, db.ForeignKey("order.id", ondelete="CASCADE"), nullable=False)
-    product_id = db.Column(db.Integer, nullable=False)
+    order_id = db.Column(
+        db.Integer, db.ForeignKey("order.id", ondelete="CASCADE"), nullable=False
+    )
+    product_id = db.Column(db.Integer, nullable=False, index=True)
     quantity = db.Column(db.Integer, nullable=False, default=1)
     price = db.Column(db.Float, nullable=False)
+    # bumped by the ORM on every update of the row
+    version = db.Column(db.Integer, nullable=False, server_default="1")
+    __mapper_args__ = {"version_id_col": version}
 
     def __repr__(self):
         return f"<Item {self.product_id} id=[{self.id}] order[{self.order_id}]>"
@@ -147,6 +261,47 @@ class Item(db.Model, PersistentBase):
             ) from error
         return self
 
+    @classmethod
+    def find_in_order(cls, order_id: int, item_id: int):
+        """Finds an Item by its ID only if it belongs to the given Order
+
+        :return: the Item, or None if there is no such Item in the Order
+
+        """
+        logger.info("Processing lookup for item %s of order %s ...", item_id, order_id)
+        return cls.query.filter(cls.order_id == order_id, cls.id == item_id).one_or_none()
+
+    @classmethod
+    def rows_by_order(cls, order_ids, columns=None) -> dict:
+        """Returns the table rows of the Items of the given Orders
+
+        The rows are read with one statement, like Order.with_items()
+
+        :param order_ids: the ids of the Orders
+        :param columns: the names of the columns to read, which must include order_id
+
+        :return: the rows of the Items of each Order by order id, in the order of their id
+        :rtype: dict
+
+        """
+        logger.info("Processing item rows of %d orders ...", len(order_ids))
+        if not order_ids:
+            return {}
+        return cls.group_by_order(cls.rows_of_orders(order_ids, columns))
+
+    @classmethod
+    def rows_of_orders(cls, order_ids, columns=None):
+        """Returns a query of the table rows of the Items of the given Orders, by id"""
+        return cls.rows(columns).filter(cls.order_id.in_(order_ids)).order_by(cls.id)
+
+    @staticmethod
+    def group_by_order(rows) -> dict:
+        """Returns the rows of Items in lists by the id of their Order"""
+        items = {}
+        for row in rows:
+            items.setdefault(row.order_id, []).append(row)
+        return items
+
 ######################################################################
 #  O R D E R   M O D E L
 #  Order: a collection of order items
@@ -161,14 +316,38 @@ class Order(db.Model, PersistentBase):
     app = None
 
     # Table Schema
+    # customer_id leads the composite index so it also serves customer only lookups
+    __table_args__ = (
+        db.Index("ix_order_customer_id_status", "customer_id", "status"),
+    )
     id = db.Column(db.Integer, primary_key=True)
     customer_id = db.Column(db.Integer, nullable=False)
     tracking_id = db.Column(db.Integer)
     created_time = db.Column(db.DateTime(), default=datetime.now)
     status = db.Column(
-        db.Enum(OrderStatus), nullable=False, server_default=(OrderStatus.PLACED.name)
+        db.Enum(OrderStatus), nullable=False, server_default=(OrderStatus.PLACED.name), index=True
+    )
+    order_items = db.relationship(
+        'Item', backref='order', cascade='save-update, merge, delete', passive_deletes=True,
+        order_by='Item.id'
+    )
+    # bumped by the ORM on every update of the row and by bump_order_versions()
+    # whenever one of its items is added, changed or removed
+    version = db.Column(db.Integer, nullable=False, server_default="1")
+    __mapper_args__ = {"version_id_col": version}
+    # counted by the database only when it is read, as by rows(["item_count"])
+    item_count = db.column_property(
+        db.select(db.func.count(Item.id)).where(Item.order_id == id).scalar_subquery(),
+        deferred=True,
     )
-    order_items = db.relationship('Item', backref='order', passive_deletes=True)
+
+    # the statuses an Order may move to, each with the statuses it may move from
+    TRANSITIONS = {
+        OrderStatus.PAID: (OrderStatus.PLACED,),
+        OrderStatus.SHIPPED: (OrderStatus.PAID,),
+        OrderStatus.DELIVERED: (OrderStatus.SHIPPED,),
+        OrderStatus.CANCELLED: (OrderStatus.PLACED, OrderStatus.PAID),
+    }
 
     def __repr__(self):
         str_return = f"<Order {self.id}: Customer_id=[{self.customer_id}], "
@@ -207,8 +386,9 @@ class Order(db.Model, PersistentBase):
             self.order_items = []
             if "order_items" in data.keys():
                 for item in data["order_items"]:
+                    # items nested in an order belong to it
                     self.order_items.append(
-                        Item().deserialize(item))
+                        Item().deserialize({"order_id": self.id, **item}))
 
         except KeyError as error:
             raise DataValidationError("Invalid Order: missing " + error.args[0]) from error
@@ -218,6 +398,169 @@ class Order(db.Model, PersistentBase):
             ) from error
         return self
 
+    @classmethod
+    def with_items(cls):
+        """Returns a query that loads the items of all its Orders in one more statement"""
+        return cls.query.options(db.selectinload(cls.order_items))
+
+    @classmethod
+    def all(cls):
+        """Returns all of the Orders in the database with their items"""
+        logger.info("Processing all records")
+        return cls.with_items().all()
+
+    @classmethod
+    def filter_criteria(cls, customer_id: int = None, status: OrderStatus = None,
+                        product_id: int = None, created_after: datetime = None,
+                        created_before: datetime = None):
+        """Returns the SQL criteria that match every one of the given filters
+
+        :param customer_id: the id of the customer you want to match
+        :param status: the status you want to match, comma separated names of statuses
+            or a list or tuple of statuses to match any of
+        :param product_id: the product id of an item the orders must include
+        :param created_after: the earliest created time, inclusive
+        :param created_before: the latest created time, exclusive
+
+        :return: one criterion for each filter that is not None
+        :rtype: list
+
+        """
+        criteria = []
+        if customer_id is not None:
+            criteria.append(cls.customer_id == customer_id)
+        if status is not None:
+            criteria.extend(cls.status_criteria(status))
+        if product_id is not None:
+            criteria.append(cls.order_items.any(Item.product_id == product_id))
+        if created_after is not None:
+            criteria.append(cls.created_time >= created_after)
+        if created_before is not None:
+            criteria.append(cls.created_time < created_before)
+        return criteria
+
+    @classmethod
+    def status_criteria(cls, status) -> list:
+        """Returns the SQL criterion of a status filter, none if it matches every status
+
+        :raises TypeError: when the status is not an OrderStatus, names of them or a list of them
+        """
+        if isinstance(status, str):
+            status = OrderStatus.parse(status)
+        if isinstance(status, OrderStatus):
+            return [cls.status == status]
+        is_list = isinstance(status, (list, tuple))
+        if not is_list or not all(isinstance(item, OrderStatus) for item in status):
+            raise TypeError(f"The status {status!r} is not an OrderStatus or a list of them")
+        if len(status) == 1:
+            return [cls.status == status[0]]
+        return [cls.status.in_(status)] if status else []
+
+    @classmethod
+    def find_rows_by_filters(cls, columns=None, **filters):
+        """Returns the table rows of all Orders that match every one of the given filters
+
+        :param columns: the names of the columns to read, all of them by default
+        :param filters: the filters of filter_criteria()
+
+        :return: a query of the rows of the matching Orders, without their items
+        :rtype: Query
+
+        """
+        logger.info("Processing filter query of rows for %s ...", filters)
+        return cls.rows(columns).filter(*cls.filter_criteria(**filters))
+
+    @classmethod
+    def find_by_filters(cls, **filters):
+        """Returns all Orders that match every one of the given filters
+
+        :param filters: the filters of filter_criteria()
+
+        :return: a collection of Orders that match all filters that are not None
+        :rtype: list
+
+        """
+        logger.info("Processing filter query for %s ...", filters)
+        return cls.with_items().filter(*cls.filter_criteria(**filters))
+
+    @classmethod
+    def statistics(cls, **filters):
+        """Returns the order, item and revenue totals of the matching Orders
+
+        The totals are aggregated by status in one GROUP BY query
+
+        :param filters: the filters of filter_criteria()
+
+        :return: the overall totals and a list with the totals of each status
+        :rtype: dict
+
+        """
+        logger.info("Processing statistics query for %s ...", filters)
+        rows = (
+            db.session.query(
+                cls.status,
+                db.func.count(db.distinct(cls.id)),
+                db.func.count(Item.id),
+                db.func.coalesce(db.func.sum(Item.quantity), 0),
+                db.func.coalesce(db.func.sum(Item.quantity * Item.price), 0.0),
+            )
+            .outerjoin(Item, Item.order_id == cls.id)
+            .filter(*cls.filter_criteria(**filters))
+            .group_by(cls.status)
+            .order_by(cls.status)
+            .all()
+        )
+        by_status = [
+            {
+                "status": order_status.name,
+                "order_count": order_count,
+                "item_count": item_count,
+                "quantity": quantity,
+                "revenue": revenue,
+            }
+            for order_status, order_count, item_count, quantity, revenue in rows
+        ]
+        totals = {
+            key: sum(entry[key] for entry in by_status)
+            for key in ("order_count", "item_count", "quantity", "revenue")
+        }
+        order_count = totals["order_count"]
+        totals["items_per_order"] = totals["item_count"] / order_count if order_count else 0.0
+        totals["by_status"] = by_status
+        return totals
+
+    @classmethod
+    def transition(cls, order_id: int, new_status: OrderStatus, versions=None):
+        """Moves an Order to a new status with one conditional UPDATE
+
+        The status is only changed when the Order is in one of the statuses
+        it may move from, so concurrent transitions can not both succeed.
+        The items of the Order are not loaded.
+
+        :param order_id: the id of the Order to move
+        :param new_status: the status to move the Order to
+        :param versions: when not None, the Order must also be at one of these versions
+
+        :return: the Order without its items, or None when no row was updated
+        :rtype: dict
+
+        """
+        logger.info("Processing transition of %s to %s ...", order_id, new_status.name)
+        table = cls.__table__
+        statement = (
+            table.update()
+            .where(table.c.id == order_id, table.c.status.in_(cls.TRANSITIONS[new_status]))
+            .values(status=new_status, version=table.c.version + 1)
+            .returning(*table.c)
+        )
+        if versions is not None:
+            statement = statement.where(table.c.version.in_(versions))
+        row = db.session.execute(statement).first()
+        db.session.commit()
+        if row is None:
+            return None
+        return {**row._mapping, "status": row.status.name}
+
     @classmethod
     def find_by_customer(cls, customer_id: int):
         """Returns all Orders of the given customer ID
@@ -230,13 +573,14 @@ class Order(db.Model, PersistentBase):
 
         """
         logger.info("Processing customer query for %d ...", customer_id)
-        return cls.query.filter(cls.customer_id == customer_id)
+        return cls.with_items().filter(cls.customer_id == customer_id)
 
     @classmethod
-    def find_by_status(cls, status: OrderStatus = OrderStatus.PLACED):
+    def find_by_status(cls, status=OrderStatus.PLACED):
         """Returns all Orders with the given status
 
-        :param status: values are ['PLACED', 'PAID', 'SHIPPED', 'DELIVERED','CANCELLED']
+        :param status: an OrderStatus, comma separated names of statuses
+            or a list or tuple of statuses to match any of
         :type available: enum
 
         :return: a collection of Orders that are with specific status
@@ -244,7 +588,7 @@ class Order(db.Model, PersistentBase):
 
         """
         logger.info("Processing status query for %s ...", status)
-        return cls.query.filter(cls.status == status)
+        return cls.with_items().filter(*cls.filter_criteria(status=status))
 
     @classmethod
     def find_by_item(cls, product_id: int):
@@ -258,4 +602,37 @@ class Order(db.Model, PersistentBase):
 
         """
         logger.info("Processing item query for %s ...", product_id)
-        return cls.query.filter(cls.order_items.any(Item.product_id == product_id))
+        return cls.with_items().filter(cls.order_items.any(Item.product_id == product_id))
+
+
+@event.listens_for(db.session, "after_flush")
+def bump_order_versions(session, flush_context):  # pylint: disable=unused-argument
+    """
+    Bumps the version of the Orders whose Items were added, changed or
+    removed in a flush, so the version of an Order covers its items
+    """
+    order_ids = set()
+    for record in session.new | session.dirty | session.deleted:
+        if isinstance(record, Item):
+            history = db.inspect(record).attrs.order_id.history
+            order_ids.update(history.sum())
+    # the ORM already bumps the Orders that were updated, created or deleted
+    for record in session.new | session.dirty | session.deleted:
+        if isinstance(record, Order) and (
+            record in session.new or record in session.deleted
+            or session.is_modified(record, include_collections=False)
+        ):
+            order_ids.discard(record.id)
+    order_ids.discard(None)
+    if not order_ids:
+        return
+
+    logger.info("Bumping the version of Orders %s", order_ids)
+    session.connection().execute(
+        Order.__table__.update()
+        .where(Order.__table__.c.id.in_(order_ids))
+        .values(version=Order.__table__.c.version + 1)
+    )
+    for record in list(session.identity_map.values()):
+        if isinstance(record, Order) and record.id in order_ids:
+            session.expire(record, ["version"])
@@ -6,42 +6,101 @@ index             GET      /
 
 list_orders     GET      /orders
 create_orders   POST     /orders
+create_orders_batch POST /orders:batch
+get_order_stats GET      /orders/stats
+export_orders   GET      /orders/export
 get_orders      GET      /orders/<int:order_id>
 update_orders   PUT      /orders/<int:order_id>
 delete_orders   DELETE   /orders/<int:order_id>
+pay_orders      PUT      /orders/<int:order_id>/pay
+ship_orders     PUT      /orders/<int:order_id>/ship
+deliver_orders  PUT      /orders/<int:order_id>/deliver
+cancel_orders   PUT      /orders/<int:order_id>/cancel
 
 list_items    GET      /orders/<int:order_id>/items
 create_items  POST     /orders/<int:order_id>/items
 get_items     GET      /orders/<int:order_id>/items/<int:item_id>
 update_items  PUT      /orders/<int:order_id>/items/<int:item_id>
 delete_items  DELETE   /orders/<int:order_id>/items/<int:item_id>
+
+list_all_items  GET      /items
+export_items    GET      /items/export
 """
+# pylint: disable=too-many-lines
 
-from flask import jsonify, make_response
-from flask_restx import Resource, fields, reqparse
-from service.models import Order, Item, OrderStatus
+import json
+import binascii
+from datetime import datetime
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from flask import (
+    Blueprint, current_app, jsonify, make_response, request, Response, stream_with_context,
+)
+from werkzeug.http import quote_etag
+from flask_restx import Resource, fields, reqparse, inputs, marshal
+from jsonschema import Draft4Validator
+from prometheus_client import CONTENT_TYPE_LATEST
+from service.models import db, Order, Item, OrderStatus, DataValidationError
 from .utils import status  # HTTP Status CodesS
+from .utils.cache import create_cache
+from .utils.compression import decoded_etag
+from .utils.metrics import render_metrics
+from .utils.serializers import RowSerializer, dumps
+
+# Import the Api of the Flask application
+from . import api, config
+
+NDJSON = "application/x-ndjson"
 
-# Import Flask application
-from . import app, api
+# serialized Orders by id, invalidated by every change to an Order or its Items
+order_cache = create_cache(config.CACHE_URL, config.CACHE_TTL, config.CACHE_MAX_SIZE)
+
+# the routes outside of the Api, registered on the app by create_app()
+blueprint = Blueprint("service", __name__)
 
 
 ######################################################################
 # GET HEALTH CHECK
 ######################################################################
-@app.route("/health")
+@blueprint.route("/health")
 def healthcheck():
     """Let them know our heart is still beating"""
     return make_response(jsonify(status=200, message="OK"), status.HTTP_200_OK)
 
 
+######################################################################
+# GET CACHE STATISTICS
+######################################################################
+@blueprint.route("/cache/stats")
+def cache_stats():
+    """Returns the hit and miss counters of the Order cache"""
+    return make_response(jsonify(order_cache.stats()), status.HTTP_200_OK)
+
+
+######################################################################
+# GET CONNECTION POOL STATISTICS
+######################################################################
+@blueprint.route("/pool/stats")
+def pool_stats():
+    """Returns the connections in use and checkout waits of the database pool"""
+    return make_response(jsonify(db.engine.pool.stats()), status.HTTP_200_OK)
+
+
+######################################################################
+# GET PROMETHEUS METRICS
+######################################################################
+@blueprint.route("/metrics")
+def metrics():
+    """Returns the request, SQL and connection pool metrics of all of the workers"""
+    return Response(render_metrics(), content_type=CONTENT_TYPE_LATEST)
+
+
 ######################################################################
 # GET INDEX
 ######################################################################
-@app.route("/")
+@blueprint.route("/")
 def index():
     """Base URL for our service"""
-    return app.send_static_file("index.html")
+    return current_app.send_static_file("index.html")
 
 
 create_item_model = api.model('Item', {
@@ -73,26 +132,127 @@ create_order_model = api.model('Order', {
                             description='The Status of the order'),
 })
 
-order_model = api.inherit(
-    'OrderModel',
+order_header_model = api.inherit(
+    'OrderHeader',
     create_order_model,
     {
         'id': fields.Integer(readOnly=True,
                              description='The unique ID assigned internally by service'),
         'created_time': fields.Date(required=False,
                                     description='The Created Time of the order'),
+    }
+)
+
+order_summary_model = api.inherit(
+    'OrderSummary',
+    order_header_model,
+    {
+        'item_count': fields.Integer(readOnly=True,
+                                     description='The number of Items of the order'),
+        'items_url': fields.String(readOnly=True,
+                                   description='The URL of the Items of the order'),
+    }
+)
+
+order_model = api.inherit(
+    'OrderModel',
+    order_header_model,
+    {
         'order_items': fields.List(fields.Nested(item_model),
                                    required=False,
                                    description='The Items of the order'),
     }
 )
 
+order_item_model = api.model('OrderItem', {
+    'product_id': fields.Integer(required=True,
+                                 description='The Product ID of the item'),
+    'quantity': fields.Integer(required=True,
+                               description='The Quantity of the item'),
+    'price': fields.Float(required=True,
+                          description='The Price of the item')
+})
+
+create_order_with_items_model = api.inherit(
+    'OrderWithItems',
+    create_order_model,
+    {
+        'order_items': fields.List(fields.Nested(order_item_model),
+                                   required=False,
+                                   description='The Items of the order'),
+    }
+)
+
+order_batch_model = api.model('OrderBatch', {
+    'ids': fields.List(fields.Integer,
+                       description='The IDs of the created Orders in the order they were posted'),
+})
+
+stats_fields = {
+    'order_count': fields.Integer(description='The number of Orders'),
+    'item_count': fields.Integer(description='The number of Items in the Orders'),
+    'quantity': fields.Integer(description='The total quantity of the Items'),
+    'revenue': fields.Float(description='The sum of quantity * price of the Items'),
+}
+
+status_stats_model = api.model('OrderStatusStats', {
+    'status': fields.String(enum=OrderStatus._member_names_,
+                            description='The Status the totals are for'),
+    **stats_fields,
+})
+
+order_stats_model = api.model('OrderStats', {
+    **stats_fields,
+    'items_per_order': fields.Float(description='The average number of Items in an Order'),
+    'by_status': fields.List(fields.Nested(status_stats_model),
+                             description='The totals of each Status'),
+})
+
 # query string arguments
-order_args = reqparse.RequestParser()
-order_args.add_argument('customer_id', type=int, required=False, help='List Orders by customer_id')
-order_args.add_argument('status', type=str, required=False, help='List Orders by status')
-order_args.add_argument('product_id', type=int, required=False,
-                        help='List Orders by Item\'s product_id')
+filter_args = reqparse.RequestParser()
+filter_args.add_argument('customer_id', type=int, required=False, help='List Orders by customer_id')
+filter_args.add_argument('status', type=OrderStatus.parse, required=False,
+                         help='List Orders by status, comma separated to match any of them')
+filter_args.add_argument('product_id', type=int, required=False,
+                         help='List Orders by Item\'s product_id')
+filter_args.add_argument('created_after', type=inputs.datetime_from_iso8601, required=False,
+                         help='List Orders created at or after this ISO 8601 time')
+filter_args.add_argument('created_before', type=inputs.datetime_from_iso8601, required=False,
+                         help='List Orders created before this ISO 8601 time')
+
+order_args = filter_args.copy()
+order_args.add_argument('limit', type=int, required=False,
+                        help='The maximum number of Orders in one page')
+order_args.add_argument('cursor', type=str, required=False,
+                        help='The opaque cursor of the next page from the Link header')
+
+fields_args = reqparse.RequestParser()
+fields_args.add_argument('fields', type=str, required=False, location='args',
+                         help='Comma separated fields to return, all of them by default')
+order_args.add_argument(fields_args.args[0])
+order_args.add_argument('embed', type=str, required=False, location='args', choices=('items',),
+                        help='items to return the Items of every Order instead of their count')
+
+batch_args = reqparse.RequestParser()
+batch_args.add_argument('report_errors', type=inputs.boolean, default=False, required=False,
+                        location='args', help='Report every invalid element, not only the first')
+
+# serialize the rows of the list endpoints straight into their models
+order_rows = RowSerializer(order_model)
+order_summary_rows = RowSerializer(order_summary_model, computed={
+    "items_url": lambda row: api.url_for(ItemCollection, order_id=row.id, _external=True)
+})
+item_rows = RowSerializer(item_model)
+
+
+def document_response(model):
+    """Documents the model like api.marshal_with, for json_response() views"""
+    return api.doc(responses={str(status.HTTP_200_OK): ("Success", model, {})}, __mask__=True)
+
+
+def document_list(model):
+    """Documents a list of the model like api.marshal_list_with, for list_response() views"""
+    return api.doc(responses={str(status.HTTP_200_OK): ("Success", [model], {})}, __mask__=True)
 
 
 # ---------------------------------------------------------------------
@@ -117,27 +277,24 @@ class OrderResource(Resource):
     # ------------------------------------------------------------------
     @api.doc('get_orders')
     @api.response(404, 'Order not found')
-    @api.marshal_with(order_model)
+    @api.response(304, 'Order not modified')
+    @api.expect(fields_args, validate=True)
+    @document_response(order_model)
     def get(self, order_id):
         """
         Retrieve a single Order
 
         This endpoint will return an Order based on it's id
         """
-        app.logger.info("Request for Order with id: %s", order_id)
-        order = Order.find(order_id)
-        if not order:
-            abort(
-                status.HTTP_404_NOT_FOUND,
-                f"Order with id '{order_id}' could not be found.",
-            )
-        return order.serialize(), status.HTTP_200_OK
+        return run_read(read_order(order_id, order_cache))
 
     # ------------------------------------------------------------------
     # UPDATE AN EXISTING ORDER
     # ------------------------------------------------------------------
     @api.doc('update_orders')
     @api.response(404, 'Order not found')
+    @api.response(409, 'The Order was changed by another request')
+    @api.response(412, 'The If-Match header does not match the Order')
     @api.response(400, 'The posted Order data was not valid')
     @api.expect(order_model, validate=True)
     @api.marshal_with(order_model)
@@ -147,35 +304,40 @@ class OrderResource(Resource):
 
         This endpoint will update an Order based the body that is posted
         """
-        app.logger.info("Request to update Order with id: %s", order_id)
+        current_app.logger.info("Request to update Order with id: %s", order_id)
         order = Order.find(order_id)
         if not order:
             abort(
                 status.HTTP_404_NOT_FOUND,
                 f"Order with id '{order_id}' was not found."
             )
-        app.logger.debug('Payload = %s', api.payload)
+        check_if_match(order.version)
+        current_app.logger.debug('Payload = %s', api.payload)
         order.deserialize(api.payload)
         order.id = order_id
         order.update()
-        return order.serialize(), status.HTTP_200_OK
+        order_cache.delete(order_id)
+        return order.serialize(), status.HTTP_200_OK, etag_header(order.version)
 
     # ------------------------------------------------------------------
     # DELETE AN ORDER
     # ------------------------------------------------------------------
     @api.doc('delete_orders')
     @api.response(204, 'Order deleted')
+    @api.response(412, 'The If-Match header does not match the Order')
     def delete(self, order_id):
         """
         Delete an Order
 
         This endpoint will delete an Order based the id specified in the path
         """
-        app.logger.info("Request to delete order with id: %s", order_id)
+        current_app.logger.info("Request to delete order with id: %s", order_id)
         order = Order.find(order_id)
         if order:
+            check_if_match(order.version)
             order.delete()
-            app.logger.info('Order with id [%s] was deleted', order_id)
+            order_cache.delete(order_id)
+            current_app.logger.info('Order with id [%s] was deleted', order_id)
 
         return '', status.HTTP_204_NO_CONTENT
 
@@ -191,29 +353,18 @@ class OrderCollection(Resource):
     # ------------------------------------------------------------------
     @api.doc('list_orders')
     @api.expect(order_args, validate=True)
-    @api.marshal_list_with(order_model)
+    @document_list(order_summary_model)
     def get(self):
-        """Returns all of the Orders"""
-        app.logger.info("Request for order list")
-        orders = []
-        args = order_args.parse_args()
-        if args["customer_id"]:
-            app.logger.info("Find by customer id: %s", args["customer_id"])
-            orders = Order.find_by_customer(args["customer_id"])
-        elif args["status"]:
-            app.logger.info("Find by status: %s", args["status"])
-            # create enum from string
-            orders = Order.find_by_status(args["status"].upper())
-        elif args["product_id"]:
-            app.logger.info("Find by items: %s", args["product_id"])
-            orders = Order.find_by_item(args["product_id"])
-        else:
-            app.logger.info("Find all")
-            orders = Order.all()
+        """
+        Returns all of the Orders
 
-        results = [order.serialize() for order in orders]
-        app.logger.info("[%s] Orders returned", len(results))
-        return results, status.HTTP_200_OK
+        The Orders can be filtered by any mix of the query arguments.
+        The list is paged by Order id, a Link header with rel="next"
+        is returned while there are more Orders to read.
+        Every Order has the count and URL of its Items, unless embed=items
+        asks for the Items themselves
+        """
+        return run_read(read_orders())
 
     # ------------------------------------------------------------------
     # ADD A NEW ORDER
@@ -227,52 +378,223 @@ class OrderCollection(Resource):
         Creates an Order
         This endpoint will create an Order based the data in the body that is posted
         """
-        app.logger.info("Request to create an Order")
+        current_app.logger.info("Request to create an Order")
         order = Order()
-        app.logger.debug('Payload = %s', api.payload)
+        current_app.logger.debug('Payload = %s', api.payload)
         order.deserialize(api.payload)
         order.create()
-        app.logger.info('Order with new id [%s] created!', order.id)
+        current_app.logger.info('Order with new id [%s] created!', order.id)
         location_url = api.url_for(OrderResource, order_id=order.id, _external=True)
         return order.serialize(), status.HTTP_201_CREATED, {"Location": location_url}
 
 
 ######################################################################
-#  PATH: /orders/{order_id}/cancel
+#  PATH: /orders/stats
+######################################################################
+@api.route('/orders/stats', strict_slashes=False)
+class OrderStatsResource(Resource):
+    """ Handles the statistics of Orders """
+    # ------------------------------------------------------------------
+    # SUMMARIZE ORDERS
+    # ------------------------------------------------------------------
+    @api.doc('get_order_stats')
+    @api.expect(filter_args, validate=True)
+    @api.marshal_with(order_stats_model)
+    def get(self):
+        """
+        Returns the statistics of the Orders
+
+        The counts and revenue of the Orders matching the same filters as
+        the Order list are computed by the database, in total and by status
+        """
+        current_app.logger.info("Request for order statistics")
+        args = filter_args.parse_args()
+        stats = Order.statistics(**order_filters(args))
+        current_app.logger.info("Statistics of [%s] Orders returned", stats["order_count"])
+        return stats, status.HTTP_200_OK
+
+
+######################################################################
+#  PATH: /orders/export
+######################################################################
+@api.route('/orders/export', strict_slashes=False)
+class OrderExportResource(Resource):
+    """ Handles exporting all of the Orders """
+    # ------------------------------------------------------------------
+    # EXPORT ORDERS
+    # ------------------------------------------------------------------
+    @api.doc('export_orders')
+    @api.expect(filter_args, validate=True)
+    @api.produces([NDJSON])
+    @api.response(200, 'One Order per line', order_model)
+    def get(self):
+        """
+        Exports the Orders as newline delimited JSON
+
+        The Orders matching the same filters as the Order list are streamed
+        from a server side cursor, so any number of them can be exported
+        """
+        current_app.logger.info("Request for order export")
+        args = filter_args.parse_args()
+        orders = Order.stream(
+            Order.find_by_filters(**order_filters(args)), config.EXPORT_BATCH_SIZE
+        )
+        return stream_ndjson(orders, order_model)
+
+
+######################################################################
+#  PATH: /orders:batch
 ######################################################################
+@api.route('/orders:batch', strict_slashes=False)
+class OrderBatchCollection(Resource):
+    """ Handles creating many Orders at once """
+    # ------------------------------------------------------------------
+    # ADD MANY NEW ORDERS
+    # ------------------------------------------------------------------
+    @api.doc('create_orders_batch')
+    @api.response(400, 'The posted data was not valid')
+    @api.expect(batch_args, [create_order_with_items_model])
+    @api.marshal_with(order_batch_model, code=201)
+    def post(self):
+        """
+        Creates many Orders
+        This endpoint will create all of the Orders in the posted array with
+        their items in one transaction, or none of them if any is not valid
+        """
+        current_app.logger.info("Request to create a batch of Orders")
+        args = batch_args.parse_args()
+        orders = deserialize_all(
+            create_order_with_items_model,
+            api.payload,
+            lambda data: Order().deserialize(data),
+            args["report_errors"],
+        )
+
+        Order.create_many(orders)
+        current_app.logger.info('Batch of [%s] Orders created!', len(orders))
+        return {"ids": [order.id for order in orders]}, status.HTTP_201_CREATED
+
+
+######################################################################
+#  PATH: /orders/{order_id}/pay, ship, deliver and cancel
+######################################################################
+class TransitionResource(Resource):
+    """
+    Base of the actions that move an Order to another status
+
+    The status is changed with one conditional UPDATE, so two requests
+    racing on the same Order can not both succeed. The Order is only read
+    again when nothing was updated, to tell why.
+    """
+    new_status = None
+    action = None
+
+    def transition(self, order_id):
+        """Moves the Order to new_status and returns it without its items"""
+        current_app.logger.info(
+            "Request to move Order with id %s to %s", order_id, self.new_status.name
+        )
+        versions = if_match_versions()
+        order = Order.transition(order_id, self.new_status, versions)
+        if order is None:
+            version = Order.find_version(order_id)
+            if version is None:
+                abort(
+                    status.HTTP_404_NOT_FOUND,
+                    f"Order with id '{order_id}' was not found."
+                )
+            check_if_match(version)
+            abort(
+                status.HTTP_400_BAD_REQUEST,
+                f"Order with id '{order_id}' cannot be {self.action}."
+            )
+        order_cache.delete(order_id)
+        current_app.logger.info('Order with id [%s] has been %s!', order_id, self.action)
+        return order, status.HTTP_200_OK, etag_header(order["version"])
+
+
+@api.route('/orders/<int:order_id>/pay')
+@api.param('order_id', 'The Order identifier')
+class PayResource(TransitionResource):
+    """ Pay actions on an Order """
+    new_status = OrderStatus.PAID
+    action = "paid"
+
+    @api.doc('pay_orders')
+    @api.response(404, 'Order not found')
+    @api.response(412, 'The If-Match header does not match the Order')
+    @api.response(400, 'The Order cannot be paid')
+    @api.marshal_with(order_header_model)
+    def put(self, order_id):
+        """
+        Pay an Order
+
+        This endpoint will move a PLACED Order to PAID
+        """
+        return self.transition(order_id)
+
+
+@api.route('/orders/<int:order_id>/ship')
+@api.param('order_id', 'The Order identifier')
+class ShipResource(TransitionResource):
+    """ Ship actions on an Order """
+    new_status = OrderStatus.SHIPPED
+    action = "shipped"
+
+    @api.doc('ship_orders')
+    @api.response(404, 'Order not found')
+    @api.response(412, 'The If-Match header does not match the Order')
+    @api.response(400, 'The Order cannot be shipped')
+    @api.marshal_with(order_header_model)
+    def put(self, order_id):
+        """
+        Ship an Order
+
+        This endpoint will move a PAID Order to SHIPPED
+        """
+        return self.transition(order_id)
+
+
+@api.route('/orders/<int:order_id>/deliver')
+@api.param('order_id', 'The Order identifier')
+class DeliverResource(TransitionResource):
+    """ Deliver actions on an Order """
+    new_status = OrderStatus.DELIVERED
+    action = "delivered"
+
+    @api.doc('deliver_orders')
+    @api.response(404, 'Order not found')
+    @api.response(412, 'The If-Match header does not match the Order')
+    @api.response(400, 'The Order cannot be delivered')
+    @api.marshal_with(order_header_model)
+    def put(self, order_id):
+        """
+        Deliver an Order
+
+        This endpoint will move a SHIPPED Order to DELIVERED
+        """
+        return self.transition(order_id)
+
+
 @api.route('/orders/<int:order_id>/cancel')
 @api.param('order_id', 'The Order identifier')
-class CancelResource(Resource):
+class CancelResource(TransitionResource):
     """ Cancel actions on an Order """
+    new_status = OrderStatus.CANCELLED
+    action = "cancelled"
+
     @api.doc('cancel_orders')
     @api.response(404, 'Order not found')
+    @api.response(412, 'The If-Match header does not match the Order')
     @api.response(400, 'The Order cannot be cancelled')
-    @api.marshal_with(order_model)
+    @api.marshal_with(order_header_model)
     def put(self, order_id):
         """
         Cancel an Order
 
-        This endpoint will cancel an Order based the body that is posted
+        This endpoint will cancel a PLACED or PAID Order
         """
-        app.logger.info("Request to cancel Order with id: %s", order_id)
-        order = Order.find(order_id)
-        if not order:
-            abort(
-                status.HTTP_404_NOT_FOUND,
-                f"Order with id '{order_id}' was not found."
-            )
-        # Check if the order can be cancelled
-        if order.status in [OrderStatus.DELIVERED, OrderStatus.SHIPPED]:
-            abort(
-                status.HTTP_400_BAD_REQUEST,
-                f"Order with id '{order_id}' cannot be cancelled."
-            )
-
-        order.status = OrderStatus.CANCELLED
-        order.id = order_id
-        order.update()
-        app.logger.info('Order with id [%s] has been cancelled!', order.id)
-        return order.serialize(), status.HTTP_200_OK
+        return self.transition(order_id)
 
 
 # ---------------------------------------------------------------------
@@ -298,29 +620,22 @@ class ItemResource(Resource):
     # ------------------------------------------------------------------
     @api.doc('get_items')
     @api.response(404, 'Item not found')
-    @api.marshal_with(item_model)
+    @api.response(304, 'Item not modified')
+    @document_response(item_model)
     def get(self, order_id, item_id):
         """
         Get an Item
         This endpoint returns just an item
         """
-        app.logger.info(
-            "Request to retrieve Item %s for Order id: %s", item_id, order_id
-        )
-
-        item = Item.find(item_id)
-        if not item:
-            abort(
-                status.HTTP_404_NOT_FOUND,
-                f"Item with id '{item_id}' could not be found.",
-            )
-        return item.serialize(), status.HTTP_200_OK
+        return run_read(read_item(order_id, item_id))
 
     # ------------------------------------------------------------------
     # UPDATE AN EXISTING ORDER'S ITEM
     # ------------------------------------------------------------------
     @api.doc('update_items')
     @api.response(404, 'Item not found')
+    @api.response(409, 'The Item was changed by another request')
+    @api.response(412, 'The If-Match header does not match the Item')
     @api.response(400, 'The posted Item data was not valid')
     @api.expect(item_model, validate=True)
     @api.marshal_with(item_model)
@@ -329,39 +644,46 @@ class ItemResource(Resource):
         Update an Item
         This endpoint will update an Item based the body that is posted
         """
-        app.logger.info(
+        current_app.logger.info(
             "Request to update Item %s for Order id: %s", (item_id, order_id)
         )
-        item = Item.find(item_id)
+        item = Item.find_in_order(order_id, item_id)
         if not item:
             abort(
                 status.HTTP_404_NOT_FOUND,
-                f"Order with id '{item_id}' could not be found.",
+                f"Item with id '{item_id}' could not be found in Order '{order_id}'.",
             )
+        check_if_match(item.version)
 
-        app.logger.debug('Payload = %s', api.payload)
+        current_app.logger.debug('Payload = %s', api.payload)
+        previous_order_id = item.order_id
         item.deserialize(api.payload)
         item.id = item_id
         item.update()
-        return item.serialize(), status.HTTP_200_OK
+        order_cache.delete(previous_order_id, item.order_id)
+        return item.serialize(), status.HTTP_200_OK, etag_header(item.version)
 
     # ------------------------------------------------------------------
     # DELETE AN ITEM
     # ------------------------------------------------------------------
     @api.doc('delete_items')
     @api.response(204, 'Item deleted')
+    @api.response(412, 'The If-Match header does not match the Item')
     def delete(self, order_id, item_id):
         """
         Delete an Item
         This endpoint will delete an Item based the id specified in the path
         """
-        app.logger.info(
+        current_app.logger.info(
             "Request to delete Item %s for Order id: %s", (item_id, order_id)
         )
-        item = Item.find(item_id)
+        item = Item.find_in_order(order_id, item_id)
         if item:
+            check_if_match(item.version)
+            item_order_id = item.order_id
             item.delete()
-            app.logger.info('Item with id [%s] was deleted', item_id)
+            order_cache.delete(item_order_id)
+            current_app.logger.info('Item with id [%s] was deleted', item_id)
 
         return '', status.HTTP_204_NO_CONTENT
 
@@ -377,20 +699,16 @@ class ItemCollection(Resource):
     # ------------------------------------------------------------------
     @api.doc('list_items')
     @api.response(404, 'Order not found')
-    @api.marshal_list_with(item_model)
+    @api.response(304, 'Items not modified')
+    @api.expect(fields_args, validate=True)
+    @document_list(item_model)
     def get(self, order_id):
-        """Returns all of the Items for an order"""
-        app.logger.info("Request for all Items for Order with id: %s", order_id)
-        order = Order.find(order_id)
-        if not order:
-            abort(
-                status.HTTP_404_NOT_FOUND,
-                f"Order with id '{order_id}' could not be found.",
-            )
+        """
+        Returns all of the Items for an order
 
-        results = [item.serialize() for item in order.order_items]
-        app.logger.info("[%s] Items returned", len(results))
-        return results, status.HTTP_200_OK
+        The ETag is the version of the Order, which changes with any of its Items
+        """
+        return run_read(read_items(order_id))
 
     # ------------------------------------------------------------------
     # ADD AN ITEM TO AN ORDER
@@ -398,14 +716,28 @@ class ItemCollection(Resource):
     @api.doc('create_items')
     @api.response(400, 'The posted data was not valid')
     @api.response(404, 'Order not found')
-    @api.expect(create_item_model, validate=True)
+    @api.expect(batch_args, create_item_model)
     @api.marshal_with(item_model, code=201)
     def post(self, order_id):
         """
-        Create an Item on an Order
-        This endpoint will add an item to an order
+        Create Items on an Order
+        This endpoint will add an item to an order, or all of the items
+        in one transaction when an array of items is posted
         """
-        app.logger.info("Request to create an Item for Order with id: %s", order_id)
+        current_app.logger.info("Request to create Items for Order with id: %s", order_id)
+        current_app.logger.debug('Payload = %s', api.payload)
+        if isinstance(api.payload, list):
+            args = batch_args.parse_args()
+            items = deserialize_all(
+                order_item_model,
+                api.payload,
+                lambda data: Item().deserialize({**data, "order_id": order_id}),
+                args["report_errors"],
+            )
+        else:
+            create_item_model.validate(api.payload, api.refresolver, api.format_checker)
+            items = None
+
         order = Order.find(order_id)
         if not order:
             abort(
@@ -413,11 +745,17 @@ class ItemCollection(Resource):
                 f"Order with id '{order_id}' could not be found.",
             )
 
+        if items is not None:
+            Item.create_many(items)
+            order_cache.delete(order_id)
+            current_app.logger.info('[%s] Items created for Order [%s]', len(items), order_id)
+            return [item.serialize() for item in items], status.HTTP_201_CREATED
+
         item = Item()
-        app.logger.debug('Payload = %s', api.payload)
         item.deserialize(api.payload)
         order.order_items.append(item)
         order.update()
+        order_cache.delete(order_id)
         return item.serialize(), status.HTTP_201_CREATED
 
 
@@ -432,15 +770,163 @@ class AllItemCollection(Resource):
     # ------------------------------------------------------------------
     @api.doc('list_all_items')
     @api.response(404, 'No Item found')
-    @api.marshal_list_with(item_model)
+    @api.expect(fields_args, validate=True)
+    @document_list(item_model)
     def get(self):
         """Returns all of the Items for an order"""
-        app.logger.info("Request for all Items")
-        all_items = Item.all()
+        return run_read(read_all_items())
 
-        results = [Item.serialize(item) for item in all_items]
-        app.logger.info("[%s] Items returned", len(results))
-        return results, status.HTTP_200_OK
+
+######################################################################
+#  PATH: /items/export
+######################################################################
+@api.route('/items/export', strict_slashes=False)
+class ItemExportResource(Resource):
+    """ Handles exporting all of the Items """
+    # ------------------------------------------------------------------
+    # EXPORT ITEMS
+    # ------------------------------------------------------------------
+    @api.doc('export_items')
+    @api.produces([NDJSON])
+    @api.response(200, 'One Item per line', item_model)
+    def get(self):
+        """
+        Exports all of the Items as newline delimited JSON
+
+        The Items are streamed from a server side cursor, so any number
+        of them can be exported
+        """
+        current_app.logger.info("Request for item export")
+        items = Item.stream(batch_size=config.EXPORT_BATCH_SIZE)
+        return stream_ndjson(items, item_model)
+
+
+######################################################################
+#  R E A D S
+######################################################################
+# The GET requests above are answered by generators that yield each query
+# they need as (method, query) and are sent back its result, where method
+# is "all", "first" or "scalar". The resources run them on db.session with
+# run_read() and service.asgi runs the same generators on an AsyncSession.
+def run_read(read):
+    """Runs a read on db.session and returns its response"""
+    try:
+        method, query = next(read)
+        while True:
+            method, query = read.send(getattr(query, method)())
+    except StopIteration as done:
+        return done.value
+
+
+def read_orders():
+    """Reads one page of the Orders"""
+    current_app.logger.info("Request for order list")
+    args = order_args.parse_args()
+    limit = check_limit(args["limit"])
+    after_id = decode_cursor(args["cursor"])
+    # every filter given narrows the same query
+    # only the columns of the requested fields are read
+    serializer = sparse(order_rows if args["embed"] == "items" else order_summary_rows, args)
+    query = Order.find_rows_by_filters(serializer.columns("id"), **order_filters(args))
+
+    orders = yield "all", Order.page_query(query, after_id, limit)
+    orders, has_more = orders[:limit], len(orders) > limit
+    related = None
+    if "order_items" in serializer.names:
+        related = {"order_items": (yield from read_items_by_order([order.id for order in orders]))}
+    current_app.logger.info("[%s] Orders returned", len(orders))
+    headers = {}
+    if has_more:
+        next_url = next_page_url(OrderCollection, args, orders[-1].id, limit)
+        headers["Link"] = f'<{next_url}>; rel="next"'
+    return list_response(serializer, orders, related, headers)
+
+
+def read_order(order_id: int, cache=None):
+    """Reads one Order, through the cache when there is one"""
+    current_app.logger.info("Request for Order with id: %s", order_id)
+    serializer = sparse(order_rows, fields_args.parse_args())
+    if request.if_none_match:
+        version = yield "scalar", Order.version_query(order_id)
+        if is_not_modified(version):
+            return None, status.HTTP_304_NOT_MODIFIED, etag_header(version)
+
+    cached = cache.get(order_id) if cache else None
+    if cached is None:
+        # a cached Order has every field, only read the requested ones otherwise
+        cached = yield from read_order_fields(order_id, serializer)
+        if cached and cache and serializer is order_rows:
+            cache.set(order_id, cached)
+    if not cached:
+        abort(
+            status.HTTP_404_NOT_FOUND,
+            f"Order with id '{order_id}' could not be found.",
+        )
+    order = serializer.pick(cached["order"])
+    return json_response(order_model, order, etag_header(cached["version"]))
+
+
+def read_order_fields(order_id: int, serializer):
+    """Reads only the columns of the fields of an Order, and its items if they are one of them"""
+    query = Order.rows(serializer.columns("id", "version")).filter(Order.id == order_id)
+    row = yield "first", query
+    if row is None:
+        return None
+    related = None
+    if "order_items" in serializer.names:
+        related = {"order_items": (yield from read_items_by_order([order_id]))}
+    return {"version": row.version, "order": serializer.to_dict(row, related)}
+
+
+def read_items(order_id: int):
+    """Reads the Items of one Order"""
+    current_app.logger.info("Request for all Items for Order with id: %s", order_id)
+    serializer = sparse(item_rows, fields_args.parse_args())
+    version = yield "scalar", Order.version_query(order_id)
+    if is_not_modified(version):
+        return None, status.HTTP_304_NOT_MODIFIED, etag_header(version)
+    if version is None:
+        abort(
+            status.HTTP_404_NOT_FOUND,
+            f"Order with id '{order_id}' could not be found.",
+        )
+
+    columns = serializer.columns("id", "order_id")
+    items = (yield from read_items_by_order([order_id], columns)).get(order_id, [])
+    current_app.logger.info("[%s] Items returned", len(items))
+    return list_response(serializer, items, headers=etag_header(version))
+
+
+def read_item(order_id: int, item_id: int):
+    """Reads one Item of an Order"""
+    current_app.logger.info("Request to retrieve Item %s for Order id: %s", item_id, order_id)
+    # an Item row is small enough to read whole even when it is not modified
+    item = yield "first", Item.rows().filter(Item.order_id == order_id, Item.id == item_id)
+    if item is None:
+        abort(
+            status.HTTP_404_NOT_FOUND,
+            f"Item with id '{item_id}' could not be found in Order '{order_id}'.",
+        )
+    if is_not_modified(item.version):
+        return None, status.HTTP_304_NOT_MODIFIED, etag_header(item.version)
+    return json_response(item_model, item_rows.to_dict(item), etag_header(item.version))
+
+
+def read_all_items():
+    """Reads all of the Items"""
+    current_app.logger.info("Request for all Items")
+    serializer = sparse(item_rows, fields_args.parse_args())
+    all_items = yield "all", Item.rows(serializer.columns("id")).order_by(Item.id)
+    current_app.logger.info("[%s] Items returned", len(all_items))
+    return list_response(serializer, all_items)
+
+
+def read_items_by_order(order_ids, columns=None):
+    """Reads the rows of the Items of the given Orders by order id, like Item.rows_by_order()"""
+    if not order_ids:
+        return {}
+    rows = yield "all", Item.rows_of_orders(order_ids, columns)
+    return Item.group_by_order(rows)
 
 
 ######################################################################
@@ -448,5 +934,179 @@ class AllItemCollection(Resource):
 ######################################################################
 def abort(error_code: int, message: str):
     """Logs errors before aborting"""
-    app.logger.error(message)
+    current_app.logger.error(message)
     api.abort(error_code, message)
+
+
+def deserialize_all(model, payload, deserialize, report_errors: bool = False) -> list:
+    """
+    Validates every element of a posted array against a model and
+    deserializes them, aborting with the index of each invalid element
+    """
+    if not isinstance(payload, list) or not payload:
+        abort(status.HTTP_400_BAD_REQUEST, "The body must be a non-empty array.")
+    if len(payload) > config.MAX_BATCH_SIZE:
+        abort(
+            status.HTTP_400_BAD_REQUEST,
+            f"A batch can hold at most {config.MAX_BATCH_SIZE} elements.",
+        )
+
+    validator = Draft4Validator(model.__schema__, resolver=api.refresolver)
+    records = []
+    errors = {}
+    for position, data in enumerate(payload):
+        problems = [error.message for error in validator.iter_errors(data)]
+        try:
+            if not problems:
+                records.append(deserialize(data))
+        except DataValidationError as error:
+            problems.append(str(error))
+        if problems:
+            errors[position] = "; ".join(problems)
+            if not report_errors:
+                break
+
+    if errors:
+        message = "Invalid element at index " + ", ".join(str(position) for position in errors)
+        current_app.logger.error(message)
+        api.abort(status.HTTP_400_BAD_REQUEST, message, errors=errors)
+    return records
+
+
+def stream_ndjson(records, model) -> Response:
+    """Streams records marshalled with a model as newline delimited JSON"""
+    def generate():
+        count = 0
+        for record in records:
+            yield json.dumps(marshal(record.serialize(), model)) + "\n"
+            count += 1
+        current_app.logger.info("[%s] records exported", count)
+
+    return Response(stream_with_context(generate()), status.HTTP_200_OK, mimetype=NDJSON)
+
+
+def json_response(model, data, headers=None):
+    """
+    Returns data already in the fields of the model as JSON
+
+    Only a request with a fields mask goes through marshal()
+    """
+    mask = request.headers.get(current_app.config["RESTX_MASK_HEADER"])
+    if mask:
+        return marshal(data, model, mask=mask), status.HTTP_200_OK, headers
+    return Response(dumps(data), status.HTTP_200_OK, headers, mimetype="application/json")
+
+
+def list_response(serializer, rows, related=None, headers=None):
+    """Returns the rows as a JSON list of the model of the serializer"""
+    return json_response(serializer.model, serializer.to_dicts(rows, related), headers)
+
+
+def sparse(serializer, args):
+    """Returns the serializer of the fields named by the fields argument, all of them by default"""
+    names = {name.strip() for name in (args["fields"] or "").split(",") if name.strip()}
+    if not names:
+        return serializer
+    unknown = names - set(serializer.names)
+    if unknown:
+        abort(
+            status.HTTP_400_BAD_REQUEST,
+            f"Unknown fields: {', '.join(sorted(unknown))}.",
+        )
+    return serializer.only(names)
+
+
+def etag_header(version: int) -> dict:
+    """Returns the strong ETag header of a record version"""
+    return {"ETag": quote_etag(str(version))}
+
+
+def etag_versions(etags, include_weak=False) -> set:
+    """Returns the record versions of ETags, whether or not the body was compressed"""
+    return {decoded_etag(tag) for tag in etags.as_set(include_weak)}
+
+
+def is_not_modified(version) -> bool:
+    """Returns True if the If-None-Match header matches the record version"""
+    if version is None:
+        return False
+    etags = request.if_none_match
+    return etags.star_tag or str(version) in etag_versions(etags, include_weak=True)
+
+
+def if_match_versions():
+    """Returns the versions listed in the If-Match header, or None if any version matches"""
+    if not request.if_match or request.if_match.star_tag:
+        return None
+    return [int(tag) for tag in etag_versions(request.if_match) if tag.isdigit()]
+
+
+def check_if_match(version: int):
+    """Aborts with 412 if the If-Match header does not match the record version"""
+    etags = request.if_match
+    if etags and not etags.star_tag and str(version) not in etag_versions(etags):
+        abort(
+            status.HTTP_412_PRECONDITION_FAILED,
+            f"The record is at version {version}, read it again and retry.",
+        )
+
+
+def order_filters(args) -> dict:
+    """Returns the Order filters of the parsed query arguments"""
+    return {
+        "customer_id": args["customer_id"],
+        "status": args["status"],
+        "product_id": args["product_id"],
+        "created_after": args["created_after"],
+        "created_before": args["created_before"],
+    }
+
+
+def check_limit(limit):
+    """Returns the page size to use for a list request"""
+    if limit is None:
+        return config.PAGE_SIZE
+    if limit < 1 or limit > config.MAX_PAGE_SIZE:
+        abort(
+            status.HTTP_400_BAD_REQUEST,
+            f"limit must be between 1 and {config.MAX_PAGE_SIZE}.",
+        )
+    return limit
+
+
+def encode_cursor(last_id: int) -> str:
+    """Creates an opaque cursor that points after the given id"""
+    return urlsafe_b64encode(json.dumps({"id": last_id}).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Returns the id a cursor points after or None for the first page"""
+    if not cursor:
+        return None
+    try:
+        last_id = json.loads(urlsafe_b64decode(cursor.encode()))["id"]
+        if not isinstance(last_id, int):
+            raise TypeError("id is not an integer")
+        return last_id
+    except (binascii.Error, ValueError, TypeError, KeyError) as error:
+        abort(status.HTTP_400_BAD_REQUEST, f"Invalid cursor: {error}")
+    return None
+
+
+def query_value(value):
+    """Returns a parsed query argument as it is written in a url"""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, tuple):
+        return ",".join(status.name for status in value)
+    return value
+
+
+def next_page_url(resource, args, last_id: int, limit: int) -> str:
+    """Builds the url of the page following last_id keeping the same filters"""
+    params = {
+        key: query_value(value) for key, value in args.items() if value is not None
+    }
+    params["cursor"] = encode_cursor(last_id)
+    params["limit"] = limit
+    return api.url_for(resource, _external=True, **params)
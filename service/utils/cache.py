@@ -0,0 +1,180 @@
+"""
+Cache
+
+This module contains the caches of serialized records, which the reads
+fill on a miss.
+A cache is picked with a url:
+
+  none://                     - no caching
+  local://                    - in process LRU cache with a TTL
+  redis://host:port/db        - shared cache on a Redis compatible server
+"""
+import json
+import time
+from abc import ABC, abstractmethod
+import logging
+import threading
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+logger = logging.getLogger("flask.app")
+
+
+class Cache(ABC):
+    """Base class of the caches that counts hits and misses"""
+
+    backend = None
+
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Returns the cached value of the key or None"""
+        value = self._get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    @abstractmethod
+    def set(self, key, value):
+        """Caches the value of the key"""
+
+    @abstractmethod
+    def delete(self, *keys):
+        """Removes the keys from the cache"""
+
+    @abstractmethod
+    def clear(self):
+        """Removes everything from the cache"""
+
+    def stats(self) -> dict:
+        """Returns the hit and miss counters of the cache"""
+        return {"backend": self.backend, "hits": self.hits, "misses": self.misses}
+
+    @abstractmethod
+    def _get(self, key):
+        """Returns the cached value of the key or None, without counting it"""
+
+
+class NullCache(Cache):
+    """A cache that never holds anything"""
+
+    backend = "none"
+
+    def set(self, key, value):
+        pass
+
+    def delete(self, *keys):
+        pass
+
+    def clear(self):
+        pass
+
+    def _get(self, key):
+        return None
+
+
+class LocalCache(Cache):
+    """An in process cache that evicts the least recently used value"""
+
+    backend = "local"
+
+    def __init__(self, ttl: int, max_size: int):
+        super().__init__(ttl)
+        self.max_size = max_size
+        self._values = OrderedDict()
+        self._lock = threading.Lock()
+
+    def set(self, key, value):
+        with self._lock:
+            self._values[key] = (time.monotonic() + self.ttl, value)
+            self._values.move_to_end(key)
+            while len(self._values) > self.max_size:
+                self._values.popitem(last=False)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._values.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def stats(self) -> dict:
+        return {**super().stats(), "size": len(self._values)}
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires <= time.monotonic():
+                del self._values[key]
+                return None
+            self._values.move_to_end(key)
+            return value
+
+
+class RedisCache(Cache):
+    """
+    A cache on a Redis compatible server shared by all of the workers
+
+    Errors talking to the server are logged and handled as misses so
+    the service keeps running from the database
+    """
+
+    backend = "redis"
+
+    def __init__(self, client, ttl: int, prefix: str = "order:"):
+        super().__init__(ttl)
+        self.client = client
+        self.prefix = prefix
+
+    def set(self, key, value):
+        try:
+            self.client.set(f"{self.prefix}{key}", json.dumps(value), ex=self.ttl)
+        except Exception as error:  # pylint: disable=broad-except
+            logger.warning("Cache set of %s failed: %s", key, error)
+
+    def delete(self, *keys):
+        if not keys:
+            return
+        try:
+            self.client.delete(*[f"{self.prefix}{key}" for key in keys])
+        except Exception as error:  # pylint: disable=broad-except
+            logger.warning("Cache delete of %s failed: %s", keys, error)
+
+    def clear(self):
+        try:
+            for name in self.client.scan_iter(f"{self.prefix}*"):
+                self.client.delete(name)
+        except Exception as error:  # pylint: disable=broad-except
+            logger.warning("Cache clear failed: %s", error)
+
+    def _get(self, key):
+        try:
+            value = self.client.get(f"{self.prefix}{key}")
+        except Exception as error:  # pylint: disable=broad-except
+            logger.warning("Cache get of %s failed: %s", key, error)
+            return None
+        return None if value is None else json.loads(value)
+
+
+def create_cache(url: str, ttl: int, max_size: int) -> Cache:
+    """Creates the cache selected by the url"""
+    scheme = urlparse(url).scheme if url else "none"
+    logger.info("Using %s cache", scheme)
+    if scheme == "none":
+        return NullCache(ttl)
+    if scheme == "local":
+        return LocalCache(ttl, max_size)
+    if scheme in ("redis", "rediss"):
+        import redis  # pylint: disable=import-outside-toplevel
+        return RedisCache(redis.Redis.from_url(url), ttl)
+    raise ValueError(f"Unknown cache url: {url}")
@@ -1,20 +1,49 @@
 """
 Flask CLI Command Extensions
+
+The commands are added to the app by service.create_app()
 """
-from service import app
+import click
+from flask.cli import ScriptInfo, with_appcontext
 from service.models import db
+from service.utils import migrations
 
 
 ######################################################################
 # Command to force tables to be rebuilt
 # Usage: flask create-db
 ######################################################################
-@app.cli.command("create-db")
+@click.command("create-db")
+@with_appcontext
 def create_db():
     """
     Recreates a local database. You probably should not use this on
     production.
     """
     db.drop_all()
-    db.create_all()
-    db.session.commit()
+    migrations.drop(db.engine)
+    migrations.upgrade(db.engine)
+
+
+######################################################################
+# Command to migrate the database schema to the one of the service
+# Usage: flask db-upgrade
+######################################################################
+@click.command("db-upgrade")
+@with_appcontext
+def db_upgrade():
+    """
+    Applies the schema migrations the database is missing. Run it before
+    the new version of the service starts.
+    """
+    applied = migrations.upgrade(db.engine)
+    if applied:
+        click.echo(f"Migrated the database schema to version {applied[-1]}")
+    else:
+        click.echo(f"The database schema is up to date at version {migrations.LATEST}")
+
+
+def in_flask_command() -> bool:
+    """Tells if the app is being loaded to run one of the flask commands"""
+    context = click.get_current_context(silent=True)
+    return context is not None and context.find_object(ScriptInfo) is not None
@@ -0,0 +1,126 @@
+"""
+Compression
+
+This module compresses the responses of the app with the encoding the
+client prefers in its Accept-Encoding header: br when brotli is
+installed, or gzip.
+
+Bodies smaller than COMPRESS_MIN_SIZE are sent as they are, since
+compressing them costs more than it saves. Streamed responses, like the
+exports, are compressed as they are streamed.
+
+A compressed body is a different representation from the identity one,
+so its strong ETag gets the encoding as a suffix, e.g. "3-gzip", and
+decoded_etag() gives back the ETag it was made from.
+"""
+import zlib
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+ENCODINGS = ("br", "gzip")
+
+# the content types worth compressing, images and archives are already compressed
+COMPRESSIBLE_TYPES = (
+    "application/json",
+    "application/x-ndjson",
+    "application/javascript",
+    "text/",
+)
+
+
+def gzip_compressor(level: int):
+    """Returns a compressor that writes the gzip format"""
+    # a window of 16 + 15 bits makes zlib write a gzip header and trailer
+    return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+
+class BrotliCompressor:
+    """Adapts a brotli compressor to the compress() and flush() of zlib"""
+
+    def __init__(self, quality: int):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        """Compresses a chunk of data, returning what is ready to be sent"""
+        return self._compressor.process(data)
+
+    def flush(self) -> bytes:
+        """Returns the rest of the compressed data"""
+        return self._compressor.finish()
+
+
+def init_compression(app):
+    """Compresses the responses of the app that are worth compressing"""
+
+    @app.after_request
+    def compress_response(response):
+        if not app.config.get("COMPRESS_ENABLED", True):
+            return response
+        if response.status_code == 304:
+            return not_modified_etag(response)
+        if not is_compressible(response):
+            return response
+        # the body may be compressed for other clients, so caches must key on the header
+        response.vary.add("Accept-Encoding")
+        if not response.is_streamed and (response.content_length or 0) < app.config["COMPRESS_MIN_SIZE"]:
+            return response
+        encodings = ["br", "gzip"] if brotli is not None else ["gzip"]
+        encoding = request.accept_encodings.best_match(encodings)
+        if encoding is None:
+            return response
+
+        if encoding == "br":
+            compressor = BrotliCompressor(app.config["COMPRESS_BROTLI_LEVEL"])
+        else:
+            compressor = gzip_compressor(app.config["COMPRESS_LEVEL"])
+        if response.is_streamed:
+            response.response = compress_stream(response.iter_encoded(), compressor)
+            response.headers.pop("Content-Length", None)
+        else:
+            response.set_data(compressor.compress(response.get_data()) + compressor.flush())
+        response.headers["Content-Encoding"] = encoding
+        tag, weak = response.get_etag()
+        if tag and not weak:
+            response.set_etag(f"{tag}-{encoding}")
+        return response
+
+
+def is_compressible(response) -> bool:
+    """Returns True if the response has a body that compressing could shrink"""
+    return (
+        response.status_code >= 200
+        and response.status_code not in (204, 304)
+        and "Content-Encoding" not in response.headers
+        and not response.direct_passthrough
+        and (response.mimetype or "").startswith(COMPRESSIBLE_TYPES)
+    )
+
+
+def compress_stream(chunks, compressor):
+    """Compresses the chunks of a streamed response as they are produced"""
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def decoded_etag(tag: str) -> str:
+    """Returns the ETag of the identity body that a compressed body's ETag was made from"""
+    base, _, encoding = tag.rpartition("-")
+    return base if base and encoding in ENCODINGS else tag
+
+
+def not_modified_etag(response):
+    """Sends back the ETag of the compressed body the client has, if it has one"""
+    tag, weak = response.get_etag()
+    if tag and not weak:
+        for requested in request.if_none_match.as_set(include_weak=True):
+            if requested != tag and decoded_etag(requested) == tag:
+                response.set_etag(requested)
+                break
+    return response
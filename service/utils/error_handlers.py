@@ -17,8 +17,10 @@
 """
 Module: error_handlers
 """
-from service.models import DataValidationError
-from service import app, api
+from flask import current_app
+from sqlalchemy.orm.exc import StaleDataError
+from service.models import DataValidationError, db
+from service import api
 from . import status
 
 
@@ -29,9 +31,22 @@ from . import status
 def request_validation_error(error):
     """ Handles Value Errors from bad data """
     message = str(error)
-    app.logger.error(message)
+    current_app.logger.error(message)
     return {
         'status_code': status.HTTP_400_BAD_REQUEST,
         'error': 'Bad Request',
         'message': message
     }, status.HTTP_400_BAD_REQUEST
+
+
+@api.errorhandler(StaleDataError)
+def version_conflict(error):
+    """ Handles records changed by another request since they were read """
+    db.session.rollback()
+    message = "The record was changed by another request, read it again and retry."
+    current_app.logger.warning("%s %s", message, error)
+    return {
+        'status_code': status.HTTP_409_CONFLICT,
+        'error': 'Conflict',
+        'message': message
+    }, status.HTTP_409_CONFLICT
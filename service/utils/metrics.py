@@ -0,0 +1,94 @@
+"""
+Metrics
+
+This module contains the Prometheus metrics of the service: the latency,
+status codes and concurrency of the requests to every endpoint, the SQL
+statements each request ran and the connection pool of the worker.
+
+When PROMETHEUS_MULTIPROC_DIR is set every gunicorn worker writes its
+samples to that directory and /metrics adds up the samples of all of
+the workers, whichever worker answers the scrape.
+"""
+import os
+import time
+from flask import g, request
+from prometheus_client import (
+    REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+)
+
+LABELS = ["method", "endpoint"]
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "Time taken to answer a request", LABELS
+)
+REQUESTS = Counter(
+    "http_requests_total", "Requests answered by status code", LABELS + ["status"]
+)
+ERRORS = Counter(
+    "http_request_errors_total", "Requests answered with a 4xx or 5xx status code", LABELS + ["status"]
+)
+IN_PROGRESS = Gauge(
+    "http_requests_in_progress", "Requests being answered", LABELS, multiprocess_mode="livesum"
+)
+DB_QUERIES = Histogram(
+    "db_queries_per_request", "SQL statements run by a request", LABELS,
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 1000),
+)
+DB_QUERY_TIME = Histogram(
+    "db_query_seconds_per_request", "Time a request spent running SQL statements", LABELS
+)
+# set by MeteredQueuePool whenever a connection is checked out or returned,
+# a request still holds its connection in after_request
+POOL_CHECKED_OUT = Gauge(
+    "db_pool_checked_out", "Database connections in use", multiprocess_mode="livesum"
+)
+POOL_OVERFLOW = Gauge(
+    "db_pool_overflow", "Database connections opened beyond the pool size", multiprocess_mode="livesum"
+)
+# observed by MeteredQueuePool on every checkout, in a request or not
+POOL_WAIT = Histogram(
+    "db_pool_wait_seconds", "Time spent waiting to check out a database connection"
+)
+POOL_TIMEOUTS = Counter(
+    "db_pool_timeouts_total", "Checkouts that gave up waiting for a database connection"
+)
+
+
+def init_metrics(app):
+    """Measures every request of the app"""
+
+    @app.before_request
+    def start_request():
+        g.metric_labels = (request.method, request.endpoint or "none")
+        g.start_time = time.perf_counter()
+        IN_PROGRESS.labels(*g.metric_labels).inc()
+
+    @app.after_request
+    def record_request(response):
+        if "metric_labels" not in g:
+            return response
+        labels = g.metric_labels
+        REQUEST_LATENCY.labels(*labels).observe(time.perf_counter() - g.start_time)
+        REQUESTS.labels(*labels, response.status_code).inc()
+        if response.status_code >= 400:
+            ERRORS.labels(*labels, response.status_code).inc()
+        # kept by the SQL profiling hooks of service.utils.profiling
+        if "db_queries" in g:
+            DB_QUERIES.labels(*labels).observe(g.db_queries)
+            DB_QUERY_TIME.labels(*labels).observe(g.db_seconds)
+        return response
+
+    @app.teardown_request
+    def end_request(error=None):  # pylint: disable=unused-argument
+        labels = g.pop("metric_labels", None)
+        if labels is not None:
+            IN_PROGRESS.labels(*labels).dec()
+
+
+def render_metrics() -> bytes:
+    """Returns the metrics in the Prometheus text format"""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
@@ -0,0 +1,131 @@
+"""
+Schema Migrations
+
+This module keeps the database schema in numbered migrations that are
+applied in order, once, by:
+
+  flask db-upgrade
+
+Every migration that ran is recorded in the schema_migrations table, so
+the app only reads the highest version when it boots instead of asking
+Postgres about every table and index. Add a migration to the end of
+MIGRATIONS for every change to the models and never edit one that was
+released. They use IF NOT EXISTS so they also adopt a database that was
+made by db.create_all() of any earlier version of the models.
+"""
+import logging
+from sqlalchemy import text
+from sqlalchemy.exc import ProgrammingError
+
+logger = logging.getLogger("flask.app")
+
+# version, description and the statements that migrate to it
+MIGRATIONS = (
+    (1, "Create the order and item tables", (
+        """
+        DO $$ BEGIN
+            CREATE TYPE orderstatus AS ENUM ('PLACED', 'PAID', 'SHIPPED', 'DELIVERED', 'CANCELLED');
+        EXCEPTION WHEN duplicate_object THEN NULL;
+        END $$
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS "order" (
+            id SERIAL NOT NULL,
+            customer_id INTEGER NOT NULL,
+            tracking_id INTEGER,
+            created_time TIMESTAMP WITHOUT TIME ZONE,
+            status orderstatus DEFAULT 'PLACED' NOT NULL,
+            version INTEGER DEFAULT 1 NOT NULL,
+            PRIMARY KEY (id)
+        )
+        """,
+        'CREATE INDEX IF NOT EXISTS ix_order_status ON "order" (status)',
+        'CREATE INDEX IF NOT EXISTS ix_order_customer_id_status ON "order" (customer_id, status)',
+        """
+        CREATE TABLE IF NOT EXISTS item (
+            id SERIAL NOT NULL,
+            order_id INTEGER NOT NULL,
+            product_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL,
+            price FLOAT NOT NULL,
+            version INTEGER DEFAULT 1 NOT NULL,
+            PRIMARY KEY (id),
+            FOREIGN KEY (order_id) REFERENCES "order" (id) ON DELETE CASCADE
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS ix_item_product_id ON item (product_id)",
+        "CREATE INDEX IF NOT EXISTS ix_item_order_id_id ON item (order_id, id)",
+    )),
+    (2, "Drop the index on item.order_id that ix_item_order_id_id covers", (
+        "DROP INDEX IF EXISTS ix_item_order_id",
+    )),
+    # the tables made by db.create_all() before the versions were added have no such columns
+    (3, "Add the version columns to tables that were made without them", (
+        'ALTER TABLE "order" ADD COLUMN IF NOT EXISTS version INTEGER DEFAULT 1 NOT NULL',
+        "ALTER TABLE item ADD COLUMN IF NOT EXISTS version INTEGER DEFAULT 1 NOT NULL",
+    )),
+)
+LATEST = MIGRATIONS[-1][0]
+
+# held while migrating so two upgrades at once run one after the other
+LOCK_ID = 20220625
+
+
+class SchemaVersionError(Exception):
+    """Used when the database schema is older than the one of the service"""
+
+
+def schema_version(engine) -> int:
+    """Returns the version of the database schema, 0 if no migration ran"""
+    try:
+        with engine.connect() as connection:
+            return connection.execute(text("SELECT max(version) FROM schema_migrations")).scalar() or 0
+    except ProgrammingError:  # there is no schema_migrations table
+        return 0
+
+
+def check(engine) -> int:
+    """Returns the version of the database schema if the service can run on it
+
+    A newer schema is fine, the migrations keep the older services working
+    while they are replaced.
+    """
+    version = schema_version(engine)
+    if version < LATEST:
+        raise SchemaVersionError(
+            f"The database schema is at version {version} but version {LATEST} is needed, "
+            "run flask db-upgrade"
+        )
+    return version
+
+
+def upgrade(engine) -> list:
+    """Applies the migrations the database is missing and returns their versions"""
+    applied = []
+    # one transaction, a migration that fails leaves the schema as it was
+    with engine.begin() as connection:
+        connection.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": LOCK_ID})
+        connection.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            "version INTEGER PRIMARY KEY, description VARCHAR(255) NOT NULL, "
+            "applied_time TIMESTAMP WITHOUT TIME ZONE DEFAULT now() NOT NULL)"
+        ))
+        version = connection.execute(text("SELECT max(version) FROM schema_migrations")).scalar() or 0
+        for number, description, statements in MIGRATIONS:
+            if number <= version:
+                continue
+            logger.info("Migrating the database schema to version %s: %s", number, description)
+            for statement in statements:
+                connection.exec_driver_sql(statement)
+            connection.execute(
+                text("INSERT INTO schema_migrations (version, description) VALUES (:version, :description)"),
+                {"version": number, "description": description},
+            )
+            applied.append(number)
+    return applied
+
+
+def drop(engine):
+    """Removes the record of the migrations, for a database that is rebuilt"""
+    with engine.begin() as connection:
+        connection.execute(text("DROP TABLE IF EXISTS schema_migrations"))
@@ -0,0 +1,97 @@
+"""
+Connection Pool
+
+This module contains the database connection pool of each worker. It
+counts the checkouts and the time spent waiting for them so the pool
+can be sized from data.
+
+It also keeps a worker from using the connections of the process it was
+forked from, such as the gunicorn master when the app is preloaded.
+"""
+import os
+import time
+import threading
+from sqlalchemy import event
+from sqlalchemy.exc import DisconnectionError, TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import Pool, QueuePool
+from service.utils.metrics import POOL_CHECKED_OUT, POOL_OVERFLOW, POOL_TIMEOUTS, POOL_WAIT
+
+
+class MeteredQueuePool(QueuePool):
+    """A QueuePool that measures how long every checkout waited for a connection
+
+    The gauges of the connections in use are set whenever a connection is
+    checked out or returned, so an idle worker reports none of them
+    """
+
+    def __init__(self, creator, **kwargs):
+        super().__init__(creator, **kwargs)
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def _do_get(self):
+        # the wait includes opening a new connection when the pool grows
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            with self._lock:
+                self.timeouts += 1
+            POOL_TIMEOUTS.inc()
+            raise
+        finally:
+            wait = time.perf_counter() - start
+            with self._lock:
+                self.checkouts += 1
+                self.wait_seconds += wait
+                self.max_wait_seconds = max(self.max_wait_seconds, wait)
+            POOL_WAIT.observe(wait)
+            self._record_usage()
+
+    def _do_return_conn(self, record):
+        super()._do_return_conn(record)
+        self._record_usage()
+
+    def _record_usage(self):
+        POOL_CHECKED_OUT.set(self.checkedout())
+        POOL_OVERFLOW.set(max(self.overflow(), 0))
+
+    def stats(self) -> dict:
+        """Returns the connections in use and the checkout wait counters"""
+        return {
+            "size": self.size(),
+            "max_overflow": self._max_overflow,
+            "checked_out": self.checkedout(),
+            "checked_in": self.checkedin(),
+            # QueuePool counts overflow from -size until the pool is full
+            "overflow": max(self.overflow(), 0),
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "wait_seconds": self.wait_seconds,
+            "max_wait_seconds": self.max_wait_seconds,
+        }
+
+
+@event.listens_for(Pool, "connect")
+def remember_process(dbapi_connection, connection_record):  # pylint: disable=unused-argument
+    """Notes the process that opened a connection"""
+    connection_record.info["pid"] = os.getpid()
+
+
+@event.listens_for(Pool, "checkout")
+def check_process(dbapi_connection, connection_record, connection_proxy):  # pylint: disable=unused-argument
+    """Refuses a connection that was opened before the process forked
+
+    The parent may still be using it, so the record lets go of it without
+    closing it and the pool opens a new connection instead.
+    """
+    pid = os.getpid()
+    if connection_record.info.get("pid", pid) != pid:
+        connection_record.dbapi_connection = connection_proxy.dbapi_connection = None
+        raise DisconnectionError(
+            f"Connection record belongs to pid {connection_record.info['pid']}, "
+            f"attempting to check out in pid {pid}"
+        )
@@ -0,0 +1,99 @@
+"""
+SQL Profiling
+
+This module keeps the SQL totals of every request: the number of
+statements, the time spent running them and the slowest one.
+
+Statements slower than SLOW_QUERY_MS are logged. When SQL_PROFILING is
+on every response also carries the totals in a Server-Timing header and
+they are logged as one JSON line per request. With SLOW_QUERY_MS set to 0
+and SQL_PROFILING off the statements are not timed at all.
+"""
+import json
+import time
+import logging
+from flask import current_app, g, request, has_app_context, has_request_context
+from sqlalchemy import event
+
+logger = logging.getLogger("flask.app")
+
+
+def is_enabled(config) -> bool:
+    """Tells if the statements should be timed"""
+    return bool(config.get("SQL_PROFILING") or config.get("SLOW_QUERY_MS"))
+
+
+def init_profiling(app, db):
+    """Counts the SQL statements of every request of the app, if profiling is enabled"""
+    if not is_enabled(app.config):
+        return
+    profile_engine(db.get_engine(app))
+
+    @app.before_request
+    def start_profile():
+        g.profile_start_time = time.perf_counter()
+        g.db_queries = 0
+        g.db_seconds = 0.0
+        g.db_slowest_seconds = 0.0
+        g.db_slowest = None
+
+    @app.after_request
+    def report_profile(response):
+        if not app.config.get("SQL_PROFILING") or "db_queries" not in g:
+            return response
+        total_ms = (time.perf_counter() - g.profile_start_time) * 1000
+        db_ms = g.db_seconds * 1000
+        slowest_ms = g.db_slowest_seconds * 1000
+        response.headers.add(
+            "Server-Timing",
+            f'db;desc="{g.db_queries} queries";dur={db_ms:.2f}, '
+            f"db-slowest;dur={slowest_ms:.2f}, total;dur={total_ms:.2f}",
+        )
+        logger.info("SQL profile %s", json.dumps({
+            "method": request.method,
+            "path": request.path,
+            "endpoint": request.endpoint,
+            "status": response.status_code,
+            "queries": g.db_queries,
+            "db_ms": round(db_ms, 2),
+            "slowest_ms": round(slowest_ms, 2),
+            "slowest": g.db_slowest,
+            "total_ms": round(total_ms, 2),
+        }))
+        return response
+
+
+def profile_engine(engine):
+    """Times the statements of the engine"""
+    if not event.contains(engine, "before_cursor_execute", start_query):
+        event.listen(engine, "before_cursor_execute", start_query)
+        event.listen(engine, "after_cursor_execute", end_query)
+        event.listen(engine, "handle_error", drop_query)
+
+
+def start_query(conn, cursor, statement, parameters, context, executemany):  # pylint: disable=too-many-arguments
+    """Notes when a SQL statement started"""
+    conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+
+def end_query(conn, cursor, statement, parameters, context, executemany):  # pylint: disable=too-many-arguments
+    """Adds a SQL statement to the totals of the current request and logs it if it was slow"""
+    elapsed = time.perf_counter() - conn.info["query_start_time"].pop()
+    if has_request_context() and "db_queries" in g:
+        g.db_queries += 1
+        g.db_seconds += elapsed
+        if elapsed > g.db_slowest_seconds:
+            g.db_slowest_seconds = elapsed
+            g.db_slowest = statement
+    threshold = current_app.config.get("SLOW_QUERY_MS") if has_app_context() else None
+    if threshold and elapsed * 1000 >= threshold:
+        # only the statement is logged, its parameters may hold customer data
+        logger.warning("Slow query took %.1f ms: %s", elapsed * 1000, statement)
+
+
+def drop_query(context):
+    """Forgets when a SQL statement that failed started"""
+    if context.connection is not None:
+        started = context.connection.info.get("query_start_time")
+        if started:
+            started.pop()
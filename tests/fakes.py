@@ -0,0 +1,34 @@
+"""
+Fakes of external services for testing
+"""
+import time
+from fnmatch import fnmatch
+
+
+class FakeRedis:
+    """An in memory stand in for the parts of a Redis client the service uses"""
+
+    def __init__(self):
+        self.values = {}
+
+    def get(self, name):
+        """Returns the value of a key that has not expired"""
+        value, expires = self.values.get(name, (None, None))
+        if expires is not None and expires <= time.monotonic():
+            del self.values[name]
+            return None
+        return value
+
+    def set(self, name, value, ex=None):
+        """Sets the value of a key that expires after ex seconds"""
+        expires = time.monotonic() + ex if ex else None
+        self.values[name] = (value.encode() if isinstance(value, str) else value, expires)
+        return True
+
+    def delete(self, *names):
+        """Removes keys and returns how many existed"""
+        return len([self.values.pop(name) for name in names if name in self.values])
+
+    def scan_iter(self, match="*"):
+        """Iterates over the keys matching a pattern"""
+        return [name for name in list(self.values) if fnmatch(name, match)]
@@ -0,0 +1,124 @@
+"""
+Test cases for the Order cache
+"""
+from unittest import TestCase
+from unittest.mock import patch, MagicMock
+from service.utils.cache import create_cache, Cache, NullCache, LocalCache, RedisCache
+from tests.fakes import FakeRedis
+
+ORDER = {"id": 1, "customer_id": 2, "status": "PLACED", "order_items": []}
+
+
+class TestLocalCache(TestCase):
+    """In process LRU cache tests"""
+
+    def test_hits_and_misses(self):
+        """It should serve a value once it is set and count the hits and misses"""
+        cache = LocalCache(ttl=60, max_size=10)
+        self.assertIsNone(cache.get(1))
+        self.assertEqual(cache.stats()["size"], 0)
+        cache.set(1, ORDER)
+        self.assertEqual(cache.get(1), ORDER)
+        self.assertEqual(cache.stats(), {"backend": "local", "hits": 1, "misses": 1, "size": 1})
+
+    def test_evict_least_recently_used(self):
+        """It should evict the least recently used value when full"""
+        cache = LocalCache(ttl=60, max_size=2)
+        cache.set(1, "one")
+        cache.set(2, "two")
+        cache.get(1)
+        cache.set(3, "three")
+        self.assertEqual(cache.get(1), "one")
+        self.assertIsNone(cache.get(2))
+        self.assertEqual(cache.get(3), "three")
+
+    @patch("service.utils.cache.time.monotonic")
+    def test_expire(self, monotonic_mock):
+        """It should expire values after the TTL"""
+        monotonic_mock.return_value = 100
+        cache = LocalCache(ttl=30, max_size=10)
+        cache.set(1, ORDER)
+        monotonic_mock.return_value = 129
+        self.assertEqual(cache.get(1), ORDER)
+        monotonic_mock.return_value = 130
+        self.assertIsNone(cache.get(1))
+
+    def test_delete(self):
+        """It should invalidate values"""
+        cache = LocalCache(ttl=60, max_size=10)
+        cache.set(1, "one")
+        cache.set(2, "two")
+        cache.delete(1, 3)
+        self.assertIsNone(cache.get(1))
+        cache.clear()
+        self.assertIsNone(cache.get(2))
+
+
+class TestRedisCache(TestCase):
+    """Redis cache tests"""
+
+    def test_hits_and_misses(self):
+        """It should keep values as JSON on the server"""
+        client = FakeRedis()
+        cache = RedisCache(client, ttl=60)
+        self.assertIsNone(cache.get(1))
+        cache.set(1, ORDER)
+        self.assertEqual(cache.get(1), ORDER)
+        self.assertIn("order:1", client.values)
+        self.assertEqual(cache.stats(), {"backend": "redis", "hits": 1, "misses": 1})
+
+    def test_delete(self):
+        """It should invalidate values on the server"""
+        client = FakeRedis()
+        cache = RedisCache(client, ttl=60)
+        cache.set(1, ORDER)
+        cache.set(2, ORDER)
+        cache.delete(1)
+        self.assertIsNone(cache.get(1))
+        cache.clear()
+        self.assertEqual(client.values, {})
+
+    def test_server_errors(self):
+        """It should handle server errors as misses"""
+        client = MagicMock()
+        client.get.side_effect = ConnectionError("down")
+        client.set.side_effect = ConnectionError("down")
+        client.delete.side_effect = ConnectionError("down")
+        cache = RedisCache(client, ttl=60)
+        cache.set(1, ORDER)
+        self.assertIsNone(cache.get(1))
+        cache.delete(1)
+        self.assertEqual(cache.misses, 1)
+
+
+class TestCreateCache(TestCase):
+    """Cache url tests"""
+
+    def test_create_cache(self):
+        """It should create the cache of the url"""
+        self.assertIsInstance(create_cache("", 30, 10), NullCache)
+        self.assertIsInstance(create_cache("none://", 30, 10), NullCache)
+        self.assertIsInstance(create_cache("local://", 30, 10), LocalCache)
+        self.assertRaises(ValueError, create_cache, "memcached://localhost", 30, 10)
+
+    def test_null_cache(self):
+        """It should never hold a value"""
+        cache = NullCache(30)
+        cache.set(1, ORDER)
+        self.assertIsNone(cache.get(1))
+
+    def test_incomplete_cache(self):
+        """It should not create a cache that is missing one of the methods of a cache"""
+        class IncompleteCache(Cache):  # pylint: disable=abstract-method
+            """A cache without clear()"""
+
+            def set(self, key, value):
+                pass
+
+            def delete(self, *keys):
+                pass
+
+            def _get(self, key):
+                return None
+
+        self.assertRaises(TypeError, IncompleteCache, 30)
@@ -1,18 +1,38 @@
 from unittest import TestCase
 from unittest.mock import patch, MagicMock
-from click.testing import CliRunner
-from service.utils.cli_commands import create_db
+from service import create_app
+from service.utils.cli_commands import create_db, db_upgrade
 
 
 class TestFlaskCLI(TestCase):
     """Test Flask CLI Commands"""
 
+    @classmethod
+    def setUpClass(cls):
+        """Creates the app the commands run in, without FLASK_APP"""
+        cls.app = create_app()
+
     def setUp(self):
-        self.runner = CliRunner()
+        self.runner = self.app.test_cli_runner()
 
+    @patch('service.utils.cli_commands.migrations')
     @patch('service.utils.cli_commands.db')
-    def test_create_db(self, db_mock):
+    def test_create_db(self, db_mock, migrations_mock):
         """It should call the create-db command"""
         db_mock.return_value = MagicMock()
         result = self.runner.invoke(create_db)
         self.assertEqual(result.exit_code, 0)
+        migrations_mock.upgrade.assert_called_once_with(db_mock.engine)
+
+    @patch('service.utils.cli_commands.migrations')
+    @patch('service.utils.cli_commands.db')
+    def test_db_upgrade(self, db_mock, migrations_mock):
+        """It should call the db-upgrade command"""
+        migrations_mock.upgrade.return_value = [1, 2]
+        result = self.runner.invoke(db_upgrade)
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn("version 2", result.output)
+        migrations_mock.upgrade.assert_called_once_with(db_mock.engine)
+        migrations_mock.upgrade.return_value = []
+        result = self.runner.invoke(db_upgrade)
+        self.assertIn("up to date", result.output)
@@ -0,0 +1,105 @@
+"""
+Test cases for the gunicorn configuration
+"""
+import os
+import runpy
+import tempfile
+from unittest import TestCase
+from unittest.mock import Mock, patch
+from service import create_app
+from service.models import db
+
+CONF_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "gunicorn.conf.py")
+MB = 1024 * 1024
+
+
+def _write(folder, name, value):
+    path = os.path.join(folder, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as file:
+        file.write(value + "\n")
+
+
+class TestGunicornConf(TestCase):
+    """Gunicorn configuration tests"""
+
+    def setUp(self):
+        # loading the configuration exports the tuning, keep it out of the other tests
+        with patch.dict(os.environ, {"DB_MAX_CONNECTIONS": "100"}):
+            self.conf = runpy.run_path(CONF_PATH)
+        self.cgroup = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.cgroup.cleanup()
+
+    def test_exports_tuning(self):
+        """It should export the workers and threads it runs for the pool sizing"""
+        env = {"WEB_CONCURRENCY": "", "GUNICORN_THREADS": "", "GUNICORN_PRELOAD": "false"}
+        with patch.dict(os.environ, env):
+            conf = runpy.run_path(CONF_PATH)
+            self.assertEqual(os.environ["WEB_CONCURRENCY"], str(conf["workers"]))
+            self.assertEqual(os.environ["GUNICORN_THREADS"], str(conf["threads"]))
+        self.assertEqual(conf["worker_class"], "gthread")
+        self.assertFalse(conf["preload_app"])
+        self.assertEqual(conf["max_requests_jitter"], conf["max_requests"] // 10)
+
+    def test_cpu_limit_v2(self):
+        """It should round a cgroup v2 CPU quota up"""
+        _write(self.cgroup.name, "cpu.max", "150000 100000")
+        self.assertEqual(self.conf["cpu_limit"](self.cgroup.name), min(2, len(os.sched_getaffinity(0))))
+        _write(self.cgroup.name, "cpu.max", "20000 100000")
+        self.assertEqual(self.conf["cpu_limit"](self.cgroup.name), 1)
+        _write(self.cgroup.name, "cpu.max", "max 100000")
+        self.assertEqual(self.conf["cpu_limit"](self.cgroup.name), len(os.sched_getaffinity(0)))
+
+    def test_cpu_limit_v1(self):
+        """It should read a cgroup v1 CPU quota"""
+        _write(self.cgroup.name, "cpu/cpu.cfs_quota_us", "20000")
+        _write(self.cgroup.name, "cpu/cpu.cfs_period_us", "100000")
+        self.assertEqual(self.conf["cpu_limit"](self.cgroup.name), 1)
+        _write(self.cgroup.name, "cpu/cpu.cfs_quota_us", "-1")
+        self.assertEqual(self.conf["cpu_limit"](self.cgroup.name), len(os.sched_getaffinity(0)))
+
+    def test_memory_limit(self):
+        """It should read the cgroup memory limit, if there is one"""
+        self.assertGreater(self.conf["memory_limit"](self.cgroup.name), 64 * MB)
+        _write(self.cgroup.name, "memory/memory.limit_in_bytes", str(64 * MB))
+        self.assertEqual(self.conf["memory_limit"](self.cgroup.name), 64 * MB)
+        _write(self.cgroup.name, "memory.max", "max")
+        self.assertGreater(self.conf["memory_limit"](self.cgroup.name), 64 * MB)
+
+    def test_tune(self):
+        """It should run 2 workers per CPU + 1 as memory allows and fit their threads in the connections"""
+        tune = self.conf["tune"]
+        self.assertEqual(tune(4, 16 * 1024 * MB, "gthread", {}), (9, 4))
+        # the memory of the deployments only fits one worker
+        self.assertEqual(tune(1, 64 * MB, "gthread", {}), (1, 4))
+        self.assertEqual(tune(2, 250 * MB, "gthread", {"GUNICORN_WORKER_MEMORY_MB": "50"}), (5, 4))
+        self.assertEqual(tune(64, 1024 * 1024 * MB, "gthread", {}), (100, 1))
+        self.assertEqual(tune(8, 16 * 1024 * MB, "gthread", {"GUNICORN_THREADS": "16"}), (17, 5))
+        self.assertEqual(tune(1, 64 * MB, "gthread", {"WEB_CONCURRENCY": "3", "GUNICORN_THREADS": "2"}), (3, 2))
+        self.assertEqual(tune(1, 1024 * MB, "gevent", {}), (3, 33))
+
+    def test_prometheus_folder(self):
+        """It should make the metrics folder before the app loads and keep the samples of the master"""
+        folder = os.path.join(self.cgroup.name, "prometheus")
+        with patch.dict(os.environ, {"PROMETHEUS_MULTIPROC_DIR": folder}):
+            conf = runpy.run_path(CONF_PATH)
+        self.assertTrue(os.path.isdir(folder))
+        for name in ("counter_1.db", "gauge_livesum_1.db", f"counter_{os.getpid()}.db"):
+            _write(folder, name, "")
+        conf["on_starting"](Mock())
+        self.assertEqual(os.listdir(folder), [f"counter_{os.getpid()}.db"])
+
+    def test_fork_hooks(self):
+        """It should dispose of the pool of the preloaded app around every fork"""
+        server = Mock()
+        server.app.callable = None
+        self.conf["pre_fork"](server, Mock())
+        self.conf["post_fork"](server, Mock())
+        server.app.callable = create_app()
+        engine = db.get_engine(server.app.callable)
+        engine.connect().close()
+        self.assertEqual(engine.pool.checkedin(), 1)
+        self.conf["pre_fork"](server, Mock())
+        self.assertEqual(db.get_engine(server.app.callable).pool.checkedin(), 0)
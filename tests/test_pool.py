@@ -0,0 +1,79 @@
+"""
+Test cases for the database connection pool
+"""
+import os
+import sqlite3
+from unittest import TestCase
+from unittest.mock import patch
+from prometheus_client import REGISTRY
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from service.utils.pool import MeteredQueuePool
+
+
+def _connect():
+    return sqlite3.connect(":memory:")
+
+
+class TestMeteredQueuePool(TestCase):
+    """Connection pool metrics tests"""
+
+    def test_count_checkouts(self):
+        """It should count the checkouts and the connections in use"""
+        pool = MeteredQueuePool(_connect, pool_size=1, max_overflow=1)
+        first = pool.connect()
+        second = pool.connect()
+        stats = pool.stats()
+        self.assertEqual(stats["checkouts"], 2)
+        self.assertEqual(stats["checked_out"], 2)
+        self.assertEqual(stats["overflow"], 1)
+        self.assertEqual(stats["max_overflow"], 1)
+        self.assertEqual(REGISTRY.get_sample_value("db_pool_checked_out"), 2)
+        self.assertEqual(REGISTRY.get_sample_value("db_pool_overflow"), 1)
+        self.assertGreater(stats["wait_seconds"], 0)
+        self.assertGreaterEqual(stats["wait_seconds"], stats["max_wait_seconds"])
+        first.close()
+        second.close()
+        stats = pool.stats()
+        self.assertEqual(stats["checked_out"], 0)
+        self.assertEqual(stats["checked_in"], 1)
+        self.assertEqual(REGISTRY.get_sample_value("db_pool_checked_out"), 0)
+        self.assertEqual(REGISTRY.get_sample_value("db_pool_overflow"), 0)
+
+    def test_count_timeouts(self):
+        """It should count the checkouts that timed out waiting for a connection"""
+        pool = MeteredQueuePool(_connect, pool_size=1, max_overflow=0, timeout=0.05)
+        conn = pool.connect()
+        waits = REGISTRY.get_sample_value("db_pool_wait_seconds_count")
+        timeouts = REGISTRY.get_sample_value("db_pool_timeouts_total")
+        self.assertRaises(PoolTimeoutError, pool.connect)
+        self.assertEqual(REGISTRY.get_sample_value("db_pool_wait_seconds_count"), waits + 1)
+        self.assertEqual(REGISTRY.get_sample_value("db_pool_timeouts_total"), timeouts + 1)
+        stats = pool.stats()
+        self.assertEqual(stats["timeouts"], 1)
+        self.assertEqual(stats["checkouts"], 2)
+        self.assertGreaterEqual(stats["max_wait_seconds"], 0.05)
+        conn.close()
+
+    def test_recreate(self):
+        """It should keep metering after the pool is recreated"""
+        pool = MeteredQueuePool(_connect, pool_size=3, max_overflow=2).recreate()
+        self.assertIsInstance(pool, MeteredQueuePool)
+        pool.connect().close()
+        self.assertEqual(pool.stats()["checkouts"], 1)
+        self.assertEqual(pool.stats()["size"], 3)
+
+    def test_forked_connection(self):
+        """It should not hand a connection of the parent process to a forked one"""
+        pool = MeteredQueuePool(_connect, pool_size=1, max_overflow=0)
+        conn = pool.connect()
+        parent_connection = conn.dbapi_connection
+        conn.close()
+        with patch("service.utils.pool.os.getpid", return_value=os.getpid() + 1):
+            conn = pool.connect()
+            child_connection = conn.dbapi_connection
+            self.assertIsNot(child_connection, parent_connection)
+            conn.close()
+            # the child keeps the connection it opened
+            self.assertIs(pool.connect().dbapi_connection, child_connection)
+        # left open for the parent
+        parent_connection.execute("SELECT 1")
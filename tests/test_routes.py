@@ -11,14 +11,26 @@ Test cases can be run with the following:
 """
 
 import os
+import gzip
+import json
 import logging
 from unittest import TestCase
-from service import app
+from unittest.mock import patch
+import brotli
+from flask_restx import marshal
+from sqlalchemy import event, text
+from prometheus_client import REGISTRY
+from service import create_app
 from service.models import db, Order, init_db, OrderStatus
+from service.routes import order_cache, order_model, item_model
 from tests.factories import OrderFactory, ItemFactory
 from service.utils import status  # HTTP Status Codes
+from service.utils import migrations, profiling
+
+app = create_app()
 
 BASE_URL = "/api/orders"
+BATCH_URL = "/api/orders:batch"
 ALL_ITEM_URL = "/api/items"
 
 DATABASE_URI = os.getenv(
@@ -44,16 +56,13 @@ class Test(TestCase):
         app.logger.setLevel(logging.CRITICAL)
         init_db(app)
 
-    @classmethod
-    def tearDownClass(cls):
-        """Runs once before test suite"""
-        db.session.close()
-
     def setUp(self):
         """Runs before each test"""
         self.app = app.test_client()
-        db.session.query(Order).delete()  # clean up the last tests
-        db.session.commit()
+        with app.app_context():
+            db.session.query(Order).delete()  # clean up the last tests
+            db.session.commit()
+        order_cache.clear()
 
     def tearDown(self):
         """Runs once after each test case"""
@@ -79,6 +88,30 @@ class Test(TestCase):
             orders.append(order)
         return orders
 
+    def _create_order(self, order_status, item_count=0):
+        """Creates an Order in the given status with some items"""
+        order = OrderFactory(status=order_status)
+        items = [ItemFactory(order_id=None).serialize() for _ in range(item_count)]
+        resp = self.app.post(BASE_URL, json={**order.serialize(), "order_items": items})
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED, "Could not create test Order")
+        order.id = resp.get_json()["id"]
+        return order
+
+    def _count_statements(self, method, *args, **kwargs):
+        """Calls a test client method and counts the SQL statements it runs"""
+        statements = []
+
+        def count_statement(conn, cursor, statement, *args):  # pylint: disable=unused-argument
+            statements.append(statement)
+
+        engine = db.get_engine(app)
+        event.listen(engine, "before_cursor_execute", count_statement)
+        try:
+            resp = method(*args, **kwargs)
+        finally:
+            event.remove(engine, "before_cursor_execute", count_statement)
+        return resp, len(statements)
+
     ######################################################################
     #  P L A C E   T E S T   C A S E S   H E R E
     ######################################################################
@@ -96,6 +129,110 @@ class Test(TestCase):
         data = resp.get_json()
         self.assertEqual(data['message'], 'OK')
 
+    def test_create_app(self):
+        """It should create apps that each serve all of the routes"""
+        other = create_app()
+        self.assertIsNot(other, app)
+        self.assertIn("create-db", other.cli.commands)
+        client = other.test_client()
+        self.assertEqual(client.get("/health").status_code, status.HTTP_200_OK)
+        self.assertEqual(client.get(BASE_URL).status_code, status.HTTP_200_OK)
+        resp = client.get(f"{BASE_URL}/0")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertIn("could not be found", resp.get_json()["message"])
+
+    def test_create_app_old_schema(self):
+        """It should not start on a database schema that needs migrating"""
+        with patch("service.utils.migrations.LATEST", migrations.LATEST + 1):
+            with self.assertRaises(SystemExit) as context:
+                create_app()
+        self.assertEqual(context.exception.code, 4)
+
+    def test_pool_stats(self):
+        """It should report the database connection pool"""
+        self.app.get(BASE_URL)
+        resp = self.app.get("/pool/stats")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertGreater(data["checkouts"], 0)
+        self.assertEqual(data["size"], app.config["SQLALCHEMY_ENGINE_OPTIONS"]["pool_size"])
+        self.assertIn("max_wait_seconds", data)
+
+    def test_metrics(self):
+        """It should count the requests, errors and SQL statements of each endpoint"""
+        def sample(name, **labels):
+            return REGISTRY.get_sample_value(name, {"method": "GET", **labels}) or 0
+
+        self._create_orders(2)
+        listed = {"endpoint": "order_collection"}
+        missing = {"endpoint": "order_resource", "status": "404"}
+        requests = sample("http_requests_total", status="200", **listed)
+        errors = sample("http_request_errors_total", **missing)
+        queries = sample("db_queries_per_request_sum", **listed)
+        self.app.get(BASE_URL)
+        self.app.get(f"{BASE_URL}/0")
+
+        resp = self.app.get("/metrics")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertTrue(resp.content_type.startswith("text/plain"))
+        self.assertIn(b"http_request_duration_seconds_bucket", resp.data)
+        self.assertEqual(sample("http_requests_total", status="200", **listed), requests + 1)
+        self.assertEqual(sample("http_request_errors_total", **missing), errors + 1)
+        self.assertEqual(sample("db_queries_per_request_sum", **listed), queries + 1)
+        self.assertEqual(sample("http_requests_in_progress", **listed), 0)
+        # the connections of the finished requests are back in the pool
+        self.assertEqual(REGISTRY.get_sample_value("db_pool_checked_out"), 0)
+
+    def test_sql_profiling(self):
+        """It should report the SQL statements of a request when profiling is on"""
+        order = self._create_orders(1)[0]
+        resp = self.app.get(f"{BASE_URL}/{order.id}")
+        self.assertNotIn("Server-Timing", resp.headers)
+
+        app.config["SQL_PROFILING"] = True
+        order_cache.clear()
+        try:
+            with self.assertLogs("flask.app", level="INFO") as logs:
+                resp = self.app.get(f"{BASE_URL}/{order.id}")
+        finally:
+            app.config["SQL_PROFILING"] = False
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        timing = resp.headers["Server-Timing"]
+        self.assertIn('db;desc="2 queries";dur=', timing)
+        self.assertIn("db-slowest;dur=", timing)
+        profile = [line for line in logs.output if "SQL profile" in line][0]
+        profile = json.loads(profile.split("SQL profile ", 1)[1])
+        self.assertEqual(profile["endpoint"], "order_resource")
+        self.assertEqual(profile["queries"], 2)
+        self.assertIn("SELECT", profile["slowest"])
+
+    def test_slow_query_log(self):
+        """It should log the SQL statements slower than the threshold"""
+        threshold = app.config["SLOW_QUERY_MS"]
+        app.config["SLOW_QUERY_MS"] = 0.000001
+        try:
+            with self.assertLogs("flask.app", level="WARNING") as logs:
+                self.app.get(BASE_URL)
+        finally:
+            app.config["SLOW_QUERY_MS"] = threshold
+        self.assertIn("Slow query took", logs.output[0])
+        self.assertIn('FROM "order"', logs.output[0])
+
+    def test_profiling_disabled(self):
+        """It should not time the SQL statements when profiling and the slow query log are off"""
+        self.assertTrue(event.contains(db.get_engine(app), "before_cursor_execute", profiling.start_query))
+        with patch("service.config.SQL_PROFILING", False), patch("service.config.SLOW_QUERY_MS", 0):
+            other = create_app()
+        engine = db.get_engine(other)
+        self.assertIsNot(engine, db.get_engine(app))
+        self.assertFalse(event.contains(engine, "before_cursor_execute", profiling.start_query))
+
+    def test_profiling_failed_statement(self):
+        """It should forget the start of a SQL statement that failed"""
+        with db.get_engine(app).connect() as conn:
+            self.assertRaises(Exception, conn.execute, text("SELECT * FROM missing"))
+            self.assertEqual(conn.info["query_start_time"], [])
+
     def test_create_order(self):
         """It should Create a new Order"""
         order = OrderFactory()
@@ -145,6 +282,52 @@ class Test(TestCase):
         self.assertEqual(updated_order["tracking_id"], 8888)
         self.assertEqual(updated_order["status"], OrderStatus.CANCELLED.name)
 
+    def test_update_order_if_match(self):
+        """It should only Update an Order when If-Match has its current ETag"""
+        # cancel below is only allowed from PLACED or PAID
+        order = self._create_order(OrderStatus.PLACED)
+        resp = self.app.get(f"{BASE_URL}/{order.id}")
+        etag = resp.headers["ETag"]
+        data = resp.get_json()
+        data["tracking_id"] = 1234
+        data["status"] = OrderStatus.PLACED.name
+
+        resp = self.app.put(f"{BASE_URL}/{order.id}", json=data, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        new_etag = resp.headers["ETag"]
+        self.assertNotEqual(new_etag, etag)
+
+        # the old ETag no longer matches
+        resp = self.app.put(f"{BASE_URL}/{order.id}", json=data, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        resp = self.app.put(f"{BASE_URL}/{order.id}/cancel", headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        resp = self.app.delete(f"{BASE_URL}/{order.id}", headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+
+        resp = self.app.put(f"{BASE_URL}/{order.id}/cancel", headers={"If-Match": new_etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["status"], OrderStatus.CANCELLED.name)
+
+    def test_update_order_conflict(self):
+        """It should not Update an Order changed by another request after it was read"""
+        order = self._create_orders(1)[0]
+        data = self.app.get(f"{BASE_URL}/{order.id}").get_json()
+        data["tracking_id"] = 1234
+
+        def find_then_change(order_id):
+            found = Order.query.get(order_id)
+            with db.engine.begin() as conn:
+                conn.execute(
+                    text('UPDATE "order" SET version = version + 1 WHERE id = :id'), {"id": order_id}
+                )
+            return found
+
+        with patch("service.routes.Order.find", side_effect=find_then_change):
+            resp = self.app.put(f"{BASE_URL}/{order.id}", json=data)
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+        self.assertNotEqual(self.app.get(f"{BASE_URL}/{order.id}").get_json()["tracking_id"], 1234)
+
     def test_update_order_not_found(self):
         """It should not Update an Order that is not found"""
         # order = OrderFactory()
@@ -198,6 +381,70 @@ class Test(TestCase):
         data = resp.get_json()
         self.assertEqual(data["id"], order.id)
 
+    def test_get_order_cached(self):
+        """It should Read an Order from the cache until it changes"""
+        order = self._create_orders(1)[0]
+        hits = order_cache.hits
+        resp = self.app.get(f"{BASE_URL}/{order.id}")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        resp = self.app.get(f"{BASE_URL}/{order.id}")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(order_cache.hits, hits + 1)
+
+        # updating the order invalidates the cached order
+        data = resp.get_json()
+        data["tracking_id"] = 4242
+        resp = self.app.put(f"{BASE_URL}/{order.id}", json=data)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.app.get(f"{BASE_URL}/{order.id}").get_json()["tracking_id"], 4242)
+
+        # and so does adding an item
+        item = {"order_id": order.id, "product_id": 1, "quantity": 1, "price": 1.0}
+        resp = self.app.post(f"{BASE_URL}/{order.id}/items", json=item)
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        data = self.app.get(f"{BASE_URL}/{order.id}").get_json()
+        self.assertEqual(len(data["order_items"]), 1)
+
+        # and deleting it
+        resp = self.app.delete(f"{BASE_URL}/{order.id}")
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        resp = self.app.get(f"{BASE_URL}/{order.id}")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        # an Order that is not found is not cached
+        self.assertIsNone(order_cache.get(order.id))
+
+        resp = self.app.get("/cache/stats")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["hits"], order_cache.hits)
+
+    def test_get_order_not_modified(self):
+        """It should not Read an Order again while its ETag matches"""
+        order = self._create_orders(1)[0]
+        resp = self.app.get(f"{BASE_URL}/{order.id}")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        etag = resp.headers["ETag"]
+
+        resp, statements = self._count_statements(
+            self.app.get, f"{BASE_URL}/{order.id}", headers={"If-None-Match": etag}
+        )
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(resp.headers["ETag"], etag)
+        self.assertEqual(resp.data, b"")
+        # answered from the version alone
+        self.assertEqual(statements, 1)
+
+        # adding an item changes the ETag of the order and its items
+        item = {"order_id": order.id, "product_id": 1, "quantity": 1, "price": 1.0}
+        resp = self.app.post(f"{BASE_URL}/{order.id}/items", json=item)
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        resp = self.app.get(f"{BASE_URL}/{order.id}", headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(resp.headers["ETag"], etag)
+        self.assertEqual(len(resp.get_json()["order_items"]), 1)
+
+        resp = self.app.get(f"{BASE_URL}/0", headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
     def test_get_order_not_found(self):
         """It should not Read an Order that is not found"""
         resp = self.app.get(f"{BASE_URL}/0")
@@ -223,6 +470,174 @@ class Test(TestCase):
         data = resp.get_json()
         self.assertEqual(len(data), 5)
 
+    def test_get_order_list_paged(self):
+        """It should List Orders one page at a time"""
+        orders = self._create_orders(5)
+        resp = self.app.get(BASE_URL, query_string="limit=2")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual([order["id"] for order in data], [order.id for order in orders[:2]])
+
+        # follow the Link headers until the last page
+        ids = [order["id"] for order in data]
+        while "Link" in resp.headers:
+            next_url = resp.headers["Link"].split(";")[0].strip("<>")
+            self.assertIn("limit=2", next_url)
+            resp = self.app.get(next_url)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            ids.extend(order["id"] for order in resp.get_json())
+        self.assertEqual(ids, [order.id for order in orders])
+
+    def test_get_order_list_statement_count(self):
+        """It should List Orders with their Items in a fixed number of statements"""
+        with app.app_context():
+            for _ in range(5):
+                order = OrderFactory()
+                order.order_items = ItemFactory.create_batch(2)
+                order.create()
+
+        resp, statements = self._count_statements(self.app.get, BASE_URL, query_string="embed=items")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(len(data), 5)
+        for order in data:
+            self.assertEqual(len(order["order_items"]), 2)
+        # one statement for the orders and one for all of their items
+        self.assertEqual(statements, 2)
+
+    def test_get_order_list_item_counts(self):
+        """It should List Orders with the count and URL of their Items by default"""
+        with app.app_context():
+            for count in range(3):
+                order = OrderFactory()
+                order.order_items = ItemFactory.create_batch(count)
+                order.create()
+
+        resp, statements = self._count_statements(self.app.get, BASE_URL)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(statements, 1)
+        data = resp.get_json()
+        self.assertEqual([order["item_count"] for order in data], [0, 1, 2])
+        for order in data:
+            self.assertNotIn("order_items", order)
+            self.assertTrue(order["items_url"].endswith(f"{BASE_URL}/{order['id']}/items"))
+            items = self.app.get(order["items_url"]).get_json()
+            self.assertEqual(len(items), order["item_count"])
+
+        resp = self.app.get(BASE_URL, query_string="fields=item_count")
+        self.assertEqual(resp.get_json(), [{"item_count": 0}, {"item_count": 1}, {"item_count": 2}])
+
+        resp = self.app.get(BASE_URL, query_string="embed=everything")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_get_order_list_bad_page(self):
+        """It should not List Orders with a bad limit or cursor"""
+        resp = self.app.get(BASE_URL, query_string="limit=0")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.get(BASE_URL, query_string="cursor=not-a-cursor")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_get_order_stats(self):
+        """It should Summarize the Orders by status"""
+        resp = self.app.post(BATCH_URL, json=[
+            {"customer_id": 1, "tracking_id": 1, "status": "PAID",
+             "order_items": [{"product_id": 11, "quantity": 2, "price": 3.5},
+                             {"product_id": 22, "quantity": 1, "price": 10.0}]},
+            {"customer_id": 1, "tracking_id": 2, "status": "PAID",
+             "order_items": [{"product_id": 11, "quantity": 4, "price": 1.0}]},
+            {"customer_id": 2, "tracking_id": 3, "status": "PLACED"},
+        ])
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+
+        resp = self.app.get(f"{BASE_URL}/stats")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        stats = resp.get_json()
+        self.assertEqual(stats["order_count"], 3)
+        self.assertEqual(stats["item_count"], 3)
+        self.assertEqual(stats["quantity"], 7)
+        self.assertAlmostEqual(stats["revenue"], 21.0)
+        self.assertAlmostEqual(stats["items_per_order"], 1.0)
+        by_status = {entry["status"]: entry for entry in stats["by_status"]}
+        self.assertEqual(by_status["PAID"]["order_count"], 2)
+        self.assertAlmostEqual(by_status["PAID"]["revenue"], 21.0)
+        self.assertEqual(by_status["PLACED"]["item_count"], 0)
+
+        # the same filters as the list
+        resp = self.app.get(f"{BASE_URL}/stats", query_string="customer_id=1&product_id=22")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        stats = resp.get_json()
+        self.assertEqual(stats["order_count"], 1)
+        self.assertEqual(stats["item_count"], 2)
+
+        resp = self.app.get(f"{BASE_URL}/stats", query_string="customer_id=99")
+        self.assertEqual(resp.get_json()["order_count"], 0)
+        self.assertEqual(resp.get_json()["by_status"], [])
+
+    def test_export_orders(self):
+        """It should Export the Orders as newline delimited JSON"""
+        orders = self._create_orders(3)
+        resp = self.app.get(f"{BASE_URL}/export")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.mimetype, "application/x-ndjson")
+        lines = resp.get_data(as_text=True).splitlines()
+        exported = [json.loads(line) for line in lines]
+        self.assertEqual([order["id"] for order in exported], [order.id for order in orders])
+        # each line is the same as the Order read on its own
+        for order in exported:
+            self.assertEqual(order, self.app.get(f"{BASE_URL}/{order['id']}").get_json())
+
+        resp = self.app.get(f"{BASE_URL}/export", query_string=f"customer_id={orders[0].customer_id}")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        for line in resp.get_data(as_text=True).splitlines():
+            self.assertEqual(json.loads(line)["customer_id"], orders[0].customer_id)
+
+    def test_create_order_batch(self):
+        """It should Create a batch of Orders with their Items"""
+        payload = []
+        for order in OrderFactory.create_batch(3):
+            data = order.serialize()
+            data["order_items"] = [
+                {"product_id": 11, "quantity": 2, "price": 3.5},
+                {"product_id": 22, "quantity": 1, "price": 10.0},
+            ]
+            payload.append(data)
+        resp = self.app.post(BATCH_URL, json=payload)
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        ids = resp.get_json()["ids"]
+        self.assertEqual(len(ids), 3)
+        self.assertEqual(ids, sorted(ids))
+
+        # check that the orders were created in the order they were posted
+        for order_id, data in zip(ids, payload):
+            resp = self.app.get(f"{BASE_URL}/{order_id}")
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            new_order = resp.get_json()
+            self.assertEqual(new_order["customer_id"], data["customer_id"])
+            self.assertEqual(new_order["tracking_id"], data["tracking_id"])
+            self.assertEqual(len(new_order["order_items"]), 2)
+            for item in new_order["order_items"]:
+                self.assertEqual(item["order_id"], order_id)
+
+    def test_create_order_batch_not_valid(self):
+        """It should not Create any Order of a batch with invalid Orders"""
+        payload = [order.serialize() for order in OrderFactory.create_batch(4)]
+        del payload[1]["customer_id"]
+        payload[3]["order_items"] = [{"product_id": 11}]
+        resp = self.app.post(BATCH_URL, json=payload)
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(list(resp.get_json()["errors"].keys()), ["1"])
+
+        resp = self.app.post(BATCH_URL, json=payload, query_string="report_errors=true")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(list(resp.get_json()["errors"].keys()), ["1", "3"])
+
+        resp = self.app.post(BATCH_URL, json={"customer_id": 1})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+        # nothing was created
+        resp = self.app.get(BASE_URL)
+        self.assertEqual(resp.get_json(), [])
+
     def test_cancel_order_succeed(self):
         """It should Cancel an existing Order"""
         # create an Order to cancel
@@ -281,6 +696,48 @@ class Test(TestCase):
             f"{BASE_URL}/{new_order_id}/cancel", json=new_order)
         self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
 
+    def test_order_transitions(self):
+        """It should Pay, Ship and Deliver an Order one status at a time"""
+        order = self._create_order(OrderStatus.PLACED)
+        etag = self.app.get(f"{BASE_URL}/{order.id}").headers["ETag"]
+        for action, new_status in (
+            ("pay", OrderStatus.PAID),
+            ("ship", OrderStatus.SHIPPED),
+            ("deliver", OrderStatus.DELIVERED),
+        ):
+            resp = self.app.put(f"{BASE_URL}/{order.id}/{action}", headers={"If-Match": etag})
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            data = resp.get_json()
+            self.assertEqual(data["status"], new_status.name)
+            self.assertNotIn("order_items", data)
+            self.assertNotEqual(resp.headers["ETag"], etag)
+            etag = resp.headers["ETag"]
+            # the cached Order was invalidated
+            resp = self.app.get(f"{BASE_URL}/{order.id}")
+            self.assertEqual(resp.get_json()["status"], new_status.name)
+            self.assertEqual(resp.headers["ETag"], etag)
+
+    def test_order_invalid_transitions(self):
+        """It should not move an Order to a status it can not reach"""
+        order = self._create_order(OrderStatus.PLACED)
+        for action in ("ship", "deliver"):
+            resp = self.app.put(f"{BASE_URL}/{order.id}/{action}")
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.put(f"{BASE_URL}/{order.id}/cancel")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        for action in ("pay", "cancel"):
+            resp = self.app.put(f"{BASE_URL}/{order.id}/{action}")
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.put(f"{BASE_URL}/0/pay")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_order_transition_statements(self):
+        """It should change the status of an Order with one SQL statement"""
+        order = self._create_order(OrderStatus.PAID, item_count=5)
+        resp, count = self._count_statements(self.app.put, f"{BASE_URL}/{order.id}/cancel")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(count, 1)
+
     # ----------------------------------------------------------
     # TEST QUERY
     # ----------------------------------------------------------
@@ -316,6 +773,72 @@ class Test(TestCase):
         for order in data:
             self.assertEqual(order["status"], OrderStatus.PLACED.name)
 
+    def test_query_by_customer_and_status(self):
+        """It should Query Orders by customer_id and status together"""
+        orders = self._create_orders(10)
+        test_customer_id = orders[0].customer_id
+        test_status = orders[0].status
+        count = len([
+            order for order in orders
+            if order.customer_id == test_customer_id and order.status == test_status
+        ])
+        response = self.app.get(
+            BASE_URL,
+            query_string=f"customer_id={test_customer_id}&status={test_status.name}"
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.get_json()
+        self.assertEqual(len(data), count)
+        for order in data:
+            self.assertEqual(order["customer_id"], test_customer_id)
+            self.assertEqual(order["status"], test_status.name)
+
+    def test_query_by_several_statuses(self):
+        """It should Query Orders matching any of several statuses"""
+        paid = self._create_order(OrderStatus.PAID)
+        shipped = self._create_order(OrderStatus.SHIPPED)
+        self._create_order(OrderStatus.PLACED)
+        response = self.app.get(BASE_URL, query_string="status=paid, SHIPPED,paid")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.get_json()
+        self.assertEqual([order["id"] for order in data], [paid.id, shipped.id])
+
+    def test_query_by_several_statuses_paged(self):
+        """It should keep the statuses in the Link to the next page"""
+        orders = [self._create_order(OrderStatus.PAID) for _ in range(2)]
+        orders.append(self._create_order(OrderStatus.SHIPPED))
+        self._create_order(OrderStatus.PLACED)
+        resp = self.app.get(BASE_URL, query_string="status=paid,shipped&limit=2")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        next_url = resp.headers["Link"].split(";")[0].strip("<>")
+        self.assertIn("status=PAID%2CSHIPPED", next_url)
+        resp = self.app.get(next_url)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual([order["id"] for order in resp.get_json()], [orders[2].id])
+
+    def test_query_by_bad_status(self):
+        """It should not Query Orders by an unknown status"""
+        resp, count = self._count_statements(self.app.get, BASE_URL, query_string="status=placed,bogus")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("'bogus' is not one of", resp.get_json()["errors"]["status"])
+        self.assertEqual(count, 0)
+
+    def test_query_by_created_time(self):
+        """It should Query Orders by a created_time range"""
+        orders = self._create_orders(3)
+        # the API only returns the date so read the full time from the database
+        with app.app_context():
+            created_after = Order.find(orders[1].id).created_time.isoformat()
+        response = self.app.get(
+            BASE_URL, query_string={"created_after": created_after, "created_before": "2999-01-01T00:00:00"}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.get_json()
+        self.assertEqual([order["id"] for order in data], [order.id for order in orders[1:]])
+
+        response = self.app.get(BASE_URL, query_string="created_after=yesterday")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_query_orders_by_item(self):
         """It should Query Orders by product id of its including item"""
         orders = self._create_orders(3)
@@ -382,6 +905,44 @@ class Test(TestCase):
         self.assertEqual(data["quantity"], item.quantity)
         self.assertEqual(data["price"], item.price)
 
+    def test_add_item_list(self):
+        """It should Add a list of Items to an order at once"""
+        order = self._create_orders(1)[0]
+        items = [
+            {"product_id": product_id, "quantity": 1, "price": 2.5}
+            for product_id in range(50)
+        ]
+        resp = self.app.post(f"{BASE_URL}/{order.id}/items", json=items)
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        data = resp.get_json()
+        self.assertEqual([item["product_id"] for item in data], list(range(50)))
+        for item in data:
+            self.assertIsNotNone(item["id"])
+            self.assertEqual(item["order_id"], order.id)
+
+        resp = self.app.get(f"{BASE_URL}/{order.id}/items")
+        self.assertEqual(len(resp.get_json()), 50)
+
+    def test_add_item_list_not_valid(self):
+        """It should not Add any Item of a list with invalid Items"""
+        order = self._create_orders(1)[0]
+        items = [
+            {"product_id": 1, "quantity": 1, "price": 2.5},
+            {"product_id": 2, "quantity": "many", "price": 2.5},
+        ]
+        resp = self.app.post(f"{BASE_URL}/{order.id}/items", json=items)
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(list(resp.get_json()["errors"].keys()), ["1"])
+
+        resp = self.app.post(f"{BASE_URL}/{order.id}/items", json=[])
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+        resp = self.app.post(f"{BASE_URL}/0/items", json=items[:1])
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+        resp = self.app.get(f"{BASE_URL}/{order.id}/items")
+        self.assertEqual(resp.get_json(), [])
+
     def test_add_item_to_order_not_found(self):
         """It should not Add Items to the order that is not found"""
         item = ItemFactory()
@@ -424,6 +985,34 @@ class Test(TestCase):
         self.assertEqual(data["quantity"], item.quantity)
         self.assertEqual(data["price"], item.price)
 
+    def test_get_items_not_modified(self):
+        """It should not Read Items again while their ETag matches"""
+        order = self._create_orders(1)[0]
+        item = {"order_id": order.id, "product_id": 1, "quantity": 1, "price": 1.0}
+        resp = self.app.post(f"{BASE_URL}/{order.id}/items", json=item)
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        item = resp.get_json()
+
+        resp = self.app.get(f"{BASE_URL}/{order.id}/items")
+        list_etag = resp.headers["ETag"]
+        resp = self.app.get(f"{BASE_URL}/{order.id}/items", headers={"If-None-Match": list_etag})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        resp = self.app.get(f"{BASE_URL}/{order.id}/items/{item['id']}")
+        item_etag = resp.headers["ETag"]
+        resp = self.app.get(f"{BASE_URL}/{order.id}/items/{item['id']}", headers={"If-None-Match": item_etag})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # updating the item changes both ETags
+        item["quantity"] = 5
+        resp = self.app.put(f"{BASE_URL}/{order.id}/items/{item['id']}", json=item)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        resp = self.app.get(f"{BASE_URL}/{order.id}/items", headers={"If-None-Match": list_etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        resp = self.app.get(f"{BASE_URL}/{order.id}/items/{item['id']}", headers={"If-None-Match": item_etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["quantity"], 5)
+
     def test_get_item_list(self):
         """It should Get a list of Items"""
         # add two items to order
@@ -494,6 +1083,181 @@ class Test(TestCase):
         data = resp.get_json()
         self.assertEqual(len(data), 4)
 
+    def test_export_items(self):
+        """It should Export all Items as newline delimited JSON"""
+        order = self._create_orders(1)[0]
+        items = [{"product_id": product_id, "quantity": 1, "price": 2.5} for product_id in range(3)]
+        resp = self.app.post(f"{BASE_URL}/{order.id}/items", json=items)
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+
+        resp = self.app.get(f"{ALL_ITEM_URL}/export")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.mimetype, "application/x-ndjson")
+        exported = [json.loads(line) for line in resp.get_data(as_text=True).splitlines()]
+        self.assertEqual(exported, self.app.get(ALL_ITEM_URL).get_json())
+
+    def _marshalled(self, records, model):
+        """Returns the JSON that marshal() and the restx JSON representation make"""
+        data = marshal([record.serialize() for record in records], model)
+        return (json.dumps(data) + "\n").encode("utf-8")
+
+    def test_list_json_matches_marshal(self):
+        """It should List the same JSON bytes as marshal() would"""
+        orders = self._create_orders(3)
+        items = [{"product_id": product_id, "quantity": 2, "price": 9.99} for product_id in range(3)]
+        self.app.post(f"{BASE_URL}/{orders[0].id}/items", json=items)
+        self.app.post(f"{BASE_URL}/{orders[2].id}/items", json=items[:1])
+        resp = self.app.get(BASE_URL, query_string="embed=items")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.mimetype, "application/json")
+        with app.app_context():
+            all_orders = sorted(Order.all(), key=lambda order: order.id)
+            self.assertEqual(resp.data, self._marshalled(all_orders, order_model))
+
+            resp = self.app.get(f"{BASE_URL}/{orders[0].id}/items")
+            self.assertEqual(resp.data, self._marshalled(all_orders[0].order_items, item_model))
+            resp = self.app.get(ALL_ITEM_URL)
+            all_items = [item for order in all_orders for item in order.order_items]
+            self.assertEqual(resp.data, self._marshalled(all_items, item_model))
+
+    def test_list_with_fields_mask(self):
+        """It should List only the fields of the X-Fields mask"""
+        self._create_orders(2)
+        resp = self.app.get(BASE_URL, headers={"X-Fields": "id,status"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        for order in resp.get_json():
+            self.assertEqual(set(order), {"id", "status"})
+
+    def test_list_with_orjson(self):
+        """It should List the same values when encoding with orjson"""
+        self._create_orders(2)
+        expected = self.app.get(BASE_URL).get_json()
+        app.config["JSON_ENCODER"] = "orjson"
+        try:
+            resp = self.app.get(BASE_URL)
+        finally:
+            app.config["JSON_ENCODER"] = "json"
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json(), expected)
+
+    def test_list_sparse_fields(self):
+        """It should List only the requested fields, without reading the items"""
+        orders = self._create_orders(3)
+        self.app.post(f"{BASE_URL}/{orders[0].id}/items", json=[{"product_id": 1, "quantity": 1, "price": 1.0}])
+        resp, count = self._count_statements(self.app.get, BASE_URL, query_string="fields=status, id")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(count, 1)
+        data = resp.get_json()
+        self.assertEqual([list(order) for order in data], [["id", "status"]] * 3)
+        self.assertEqual([order["id"] for order in data], [order.id for order in orders])
+
+        resp, count = self._count_statements(self.app.get, BASE_URL, query_string="fields=order_items&embed=items")
+        self.assertEqual(count, 2)
+        self.assertEqual(len(resp.get_json()[0]["order_items"]), 1)
+
+        resp = self.app.get(BASE_URL, query_string="fields=id,bogus")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("bogus", resp.get_json()["message"])
+
+    def test_get_order_sparse_fields(self):
+        """It should Read only the requested fields of an Order"""
+        order = self._create_orders(1)[0]
+        resp, count = self._count_statements(
+            self.app.get, f"{BASE_URL}/{order.id}", query_string="fields=tracking_id"
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(count, 1)
+        self.assertEqual(resp.get_json(), {"tracking_id": order.tracking_id})
+        etag = resp.headers["ETag"]
+
+        # a cached Order is picked from instead
+        self.app.get(f"{BASE_URL}/{order.id}")
+        resp, count = self._count_statements(
+            self.app.get, f"{BASE_URL}/{order.id}", query_string="fields=id,status"
+        )
+        self.assertEqual(count, 0)
+        self.assertEqual(resp.get_json(), {"id": order.id, "status": order.status.name})
+        self.assertEqual(resp.headers["ETag"], etag)
+
+        resp = self.app.get(f"{BASE_URL}/0", query_string="fields=id")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_list_items_sparse_fields(self):
+        """It should List only the requested fields of Items"""
+        order = self._create_orders(1)[0]
+        items = [{"product_id": product_id, "quantity": 1, "price": 2.5} for product_id in range(2)]
+        self.app.post(f"{BASE_URL}/{order.id}/items", json=items)
+        for url in (f"{BASE_URL}/{order.id}/items", ALL_ITEM_URL):
+            resp = self.app.get(url, query_string="fields=product_id")
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            self.assertEqual(resp.get_json(), [{"product_id": 0}, {"product_id": 1}])
+
+    def test_compressed_list(self):
+        """It should compress a large list with the encoding the client prefers"""
+        self._create_orders(10)
+        plain = self.app.get(BASE_URL)
+        self.assertNotIn("Content-Encoding", plain.headers)
+
+        resp = self.app.get(BASE_URL, headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", resp.headers["Vary"])
+        self.assertLess(len(resp.data), len(plain.data))
+        self.assertEqual(gzip.decompress(resp.data), plain.data)
+
+        resp = self.app.get(BASE_URL, headers={"Accept-Encoding": "gzip;q=0.5, br"})
+        self.assertEqual(resp.headers["Content-Encoding"], "br")
+        self.assertEqual(brotli.decompress(resp.data), plain.data)
+
+        resp = self.app.get(BASE_URL, headers={"Accept-Encoding": "identity"})
+        self.assertNotIn("Content-Encoding", resp.headers)
+
+    def test_compression_skips_small_bodies(self):
+        """It should not compress bodies smaller than the threshold"""
+        resp = self.app.get("/health", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertNotIn("Content-Encoding", resp.headers)
+        self.assertEqual(resp.get_json()["message"], "OK")
+        # a larger body of the same url would be compressed
+        self.assertIn("Accept-Encoding", resp.headers["Vary"])
+
+    def test_compressed_etag(self):
+        """It should give a compressed Order an ETag of its own that still matches the Order"""
+        order = self._create_order(OrderStatus.PLACED, item_count=10)
+        url = f"{BASE_URL}/{order.id}"
+        plain = self.app.get(url)
+        self.assertNotIn("Content-Encoding", plain.headers)
+        self.assertIn("Accept-Encoding", plain.headers["Vary"])
+        tag = plain.get_etag()[0]
+
+        resp = self.app.get(url, headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        self.assertEqual(resp.get_etag(), (f"{tag}-gzip", False))
+        etag = resp.headers["ETag"]
+
+        resp = self.app.get(url, headers={"Accept-Encoding": "gzip", "If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(resp.headers["ETag"], etag)
+        resp = self.app.get(url, headers={"If-None-Match": plain.headers["ETag"]})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(resp.headers["ETag"], plain.headers["ETag"])
+
+        resp = self.app.put(f"{url}/cancel", headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        resp = self.app.put(url, json=plain.get_json(), headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+
+    def test_compressed_export(self):
+        """It should compress an export as it is streamed"""
+        self._create_orders(3)
+        plain = self.app.get(f"{BASE_URL}/export").data
+        resp = self.app.get(f"{BASE_URL}/export", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertTrue(resp.is_streamed)
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        self.assertNotIn("Content-Length", resp.headers)
+        self.assertEqual(gzip.decompress(resp.data), plain)
+
     def test_get_item_list_of_order_not_found(self):
         """It should not List Items of the order that is not found"""
         resp = self.app.get(f"{BASE_URL}/0/items")
@@ -544,6 +1308,53 @@ class Test(TestCase):
         self.assertEqual(data["quantity"], 8888)
         self.assertEqual(data["price"], 7777)
 
+    def test_update_item_if_match(self):
+        """It should only Update an Item when If-Match has its current ETag"""
+        order = self._create_orders(1)[0]
+        item = {"order_id": order.id, "product_id": 1, "quantity": 1, "price": 1.0}
+        item = self.app.post(f"{BASE_URL}/{order.id}/items", json=item).get_json()
+        etag = self.app.get(f"{BASE_URL}/{order.id}/items/{item['id']}").headers["ETag"]
+
+        item["quantity"] = 2
+        resp = self.app.put(f"{BASE_URL}/{order.id}/items/{item['id']}", json=item, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        resp = self.app.put(f"{BASE_URL}/{order.id}/items/{item['id']}", json=item, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        resp = self.app.delete(f"{BASE_URL}/{order.id}/items/{item['id']}", headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        resp = self.app.delete(f"{BASE_URL}/{order.id}/items/{item['id']}", headers={"If-Match": "*"})
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+
+    def test_item_of_another_order(self):
+        """It should not Read, Update or Delete an Item through another Order"""
+        order = self._create_order(OrderStatus.PLACED, item_count=1)
+        other = self._create_order(OrderStatus.PLACED)
+        item = self.app.get(f"{BASE_URL}/{order.id}/items").get_json()[0]
+        url = f"{BASE_URL}/{other.id}/items/{item['id']}"
+
+        resp = self.app.get(url)
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        resp = self.app.put(url, json={**item, "quantity": 99})
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        resp = self.app.delete(url)
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+
+        resp = self.app.get(f"{BASE_URL}/{order.id}/items/{item['id']}")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json(), item)
+
+    def test_get_item_statement_count(self):
+        """It should Get an Item with one statement, modified or not"""
+        order = self._create_order(OrderStatus.PLACED, item_count=1)
+        item = self.app.get(f"{BASE_URL}/{order.id}/items").get_json()[0]
+        url = f"{BASE_URL}/{order.id}/items/{item['id']}"
+        resp, count = self._count_statements(self.app.get, url)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(count, 1)
+        resp, count = self._count_statements(self.app.get, url, headers={"If-None-Match": resp.headers["ETag"]})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(count, 1)
+
     def test_update_item_not_found(self):
         """It should not Update an Item that is not found"""
         order = self._create_orders(1)[0]